@@ -0,0 +1,586 @@
+"""
+Offline benchmark for main.py.
+
+Starts local stand-in servers for the Graph API, the X API, Gemini, trends24.in, the
+image catalog JSON and the image host, points main.py at them through its endpoint
+settings (GRAPH_API_URL, TWITTER_API_URL, GEMINI_API_ENDPOINT, TRENDS_URL, IMAGE_URLS_URL)
+and drives send_social_media_post() and each stage function under a fixed load.
+Every scenario runs in its own fresh interpreter, so its import cost, caches and peak RSS
+are measured on their own. Reports throughput, p50/p99 latency and peak RSS per scenario.
+
+Usage:
+    python benchmark.py                                  # every scenario
+    python benchmark.py cycle trends --iterations 50 --concurrency 8
+    python benchmark.py post_twitter --service-latency x=300 --service-error-rate x=0.1
+    python benchmark.py hashtags --latency-scale 0 --json results.json
+"""
+import os
+import random
+import time
+import argparse
+import json
+import math
+import multiprocessing
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# --- Stand-in Servers ---
+# Each service gets its own server (and port), so main.py keeps one connection pool per
+# host as it does against the real services. Every response is delayed by the service's
+# latency (plus up to JITTER of it at random) and fails with a 503 at the service's error rate.
+SERVICES = ("graph", "x", "gemini", "trends", "catalog", "images")
+DEFAULT_LATENCY_MS = {"graph": 80, "x": 80, "gemini": 600, "trends": 150, "catalog": 40, "images": 60}
+FAKE_TRENDS = ["#KenyaAt60", "Nairobi", "#GreenCity", "Ruto", "#MondayMotivation", "Mombasa", "#TreePlanting"]
+
+
+def padded_jpeg(size_bytes, width=1200, height=800):
+    """
+    Returns a valid JPEG of roughly size_bytes: a small gradient image padded with
+    comment (COM) segments, which decoders skip.
+    """
+    from PIL import Image
+
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    out = tempfile.SpooledTemporaryFile()
+    image.save(out, format="JPEG", quality=85)
+    out.seek(0)
+    data = out.read()
+    padding = []
+    missing = size_bytes - len(data)
+    while missing > 4:
+        chunk = min(missing - 4, 65533)
+        padding.append(b"\xff\xfe" + (chunk + 2).to_bytes(2, "big") + b"\0" * chunk)
+        missing -= chunk + 4
+    return data[:2] + b"".join(padding) + data[2:]
+
+
+def trends_page(size_bytes):
+    """
+    Returns a trends24.in-like page of roughly size_bytes: one list-container with the
+    current trends, followed by older hourly lists.
+    """
+    def trend_list(trends):
+        items = "".join(f'<li><a href="/kenya/{t}">{t}</a><span>12K</span></li>' for t in trends)
+        return f'<div class="list-container"><h3>1 hour ago</h3><ol class="trend-card__list">{items}</ol></div>'
+
+    parts = ["<html><head><title>Kenya Trends</title></head><body>", trend_list(FAKE_TRENDS)]
+    size = sum(len(part) for part in parts)
+    while size < size_bytes:
+        parts.append(trend_list(FAKE_TRENDS[::-1]))
+        size += len(parts[-1])
+    parts.append("</body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def gemini_text(chars, rng):
+    """
+    Returns a post-like text of chars characters made of random made-up words, so texts
+    differ the way real generations do (and pass the near-duplicate check).
+    """
+    text = []
+    while sum(len(word) + 1 for word in text) < chars:
+        text.append("".join(rng.choice("bcdfghjklmnprstvwz") + rng.choice("aeiou") for _ in range(rng.randint(2, 4))))
+    return " ".join(text)[:chars]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Routes requests to the handler of its server's service (see serve_stand_ins).
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        with server.lock:
+            server.requests += 1
+            delay = server.latency * (1 + server.jitter * server.rng.random())
+            fail = server.rng.random() < server.error_rate
+            if fail:
+                server.errors += 1
+        time.sleep(delay)
+        if fail:
+            return self.reply(503, {"error": {"message": "Injected benchmark error"}})
+        route = getattr(self, f"route_{server.service}")
+        route(method, urlsplit(self.path), body)
+
+    def reply(self, status, payload, content_type="application/json", headers=None):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def reply_stream(self, items):
+        """Sends items as one JSON array in HTTP chunks, the way Gemini streams over REST."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for index, item in enumerate(items):
+                data = (b"[" if index == 0 else b",") + json.dumps(item).encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.write(b"1\r\n]\r\n0\r\n\r\n" if items else b"2\r\n[]\r\n0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading once it had enough text
+            self.close_connection = True
+
+    def reply_cacheable(self, payload, content_type, etag):
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.reply(200, payload, content_type, {"ETag": etag})
+
+    def next_id(self):
+        with self.server.lock:
+            self.server.ids += 1
+            return str(10 ** 17 + self.server.ids)
+
+    def route_graph(self, method, url, body):
+        headers = {"X-App-Usage": json.dumps({"call_count": 1, "total_time": 1, "total_cputime": 1})}
+        path = url.path.rstrip("/")
+        if path.endswith("/feed"):
+            return self.reply(200, {"id": f"page_{self.next_id()}"}, headers=headers)
+        if path.endswith("/photos"):
+            photo_id = self.next_id()
+            return self.reply(200, {"id": photo_id, "post_id": f"page_{photo_id}"}, headers=headers)
+        if method == "DELETE" and path.count("/") == 2:
+            return self.reply(200, {"success": True}, headers=headers)
+        if method == "POST" and path.count("/") <= 1:
+            # Batch request: one result per operation
+            form = parse_qs(body.decode("utf-8"))
+            batch = json.loads(form.get("batch", ["[]"])[0])
+            results = [{"code": 200, "body": json.dumps({"id": f"page_{self.next_id()}"})} for _ in batch]
+            if form.get("include_headers") == ["true"]:
+                usage = json.dumps({"call_count": 1, "total_time": 1, "total_cputime": 1})
+                for result in results:
+                    result["headers"] = [{"name": "X-Page-Usage", "value": usage}]
+            return self.reply(200, results, headers=headers)
+        self.reply(404, {"error": {"message": f"Unknown Graph path {url.path}"}})
+
+    def route_x(self, method, url, body):
+        headers = {
+            "x-rate-limit-limit": "100000",
+            "x-rate-limit-remaining": "99999",
+            "x-rate-limit-reset": str(int(time.time()) + 900),
+        }
+        path = url.path.rstrip("/")
+        if path == "/2/tweets":
+            return self.reply(201, {"data": {"id": self.next_id(), "text": "benchmark"}}, headers=headers)
+        if path == "/2/media/upload":
+            if method == "GET":
+                return self.reply(200, {"data": {"processing_info": {"state": "succeeded"}}}, headers=headers)
+            return self.reply(200, {"data": {"id": self.next_id()}}, headers=headers)
+        if path == "/2/media/upload/initialize":
+            return self.reply(200, {"data": {"id": self.next_id()}}, headers=headers)
+        if path.endswith("/append"):
+            return self.reply(200, {}, headers=headers)
+        if path.endswith("/finalize"):
+            return self.reply(200, {"data": {"id": path.split("/")[-2]}}, headers=headers)
+        self.reply(404, {"errors": [{"message": f"Unknown X path {url.path}"}]})
+
+    def route_gemini(self, method, url, body):
+        if url.path.endswith(":generateContent"):
+            with self.server.lock:
+                text = gemini_text(self.server.gemini_chars, self.server.rng)
+            return self.reply(200, {
+                "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": 1}],
+            })
+        if url.path.endswith(":streamGenerateContent"):
+            with self.server.lock:
+                text = gemini_text(self.server.gemini_chars, self.server.rng)
+            return self.reply_stream([
+                {"candidates": [{"content": {"parts": [{"text": text[start:start + 64]}], "role": "model"}}]}
+                for start in range(0, len(text), 64)
+            ])
+        self.reply(404, {"error": {"message": f"Unknown Gemini path {url.path}"}})
+
+    def route_trends(self, method, url, body):
+        self.reply_cacheable(self.server.trends_page, "text/html; charset=utf-8", '"trends-v1"')
+
+    def route_catalog(self, method, url, body):
+        self.reply_cacheable(self.server.catalog, "application/json", '"catalog-v1"')
+
+    def route_images(self, method, url, body):
+        self.reply_cacheable(self.server.image, "image/jpeg", f'"{url.path}-v1"')
+
+
+def serve_stand_ins(config, connection):
+    """
+    Runs the stand-in servers (in the benchmark's child process) until told to stop.
+    Sends {service: base URL} over the connection once they listen, then answers
+    "stats" with per-service request and injected error counts.
+    """
+    servers = {}
+    for index, service in enumerate(SERVICES):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        server.daemon_threads = True
+        server.service = service
+        server.lock = threading.Lock()
+        server.rng = random.Random(config["seed"] + index)
+        server.latency = config["latency_ms"][service] / 1000
+        server.jitter = config["jitter"]
+        server.error_rate = config["error_rate"][service]
+        server.requests = server.errors = server.ids = 0
+        servers[service] = server
+    urls = {service: f"http://127.0.0.1:{server.server_port}" for service, server in servers.items()}
+    servers["trends"].trends_page = trends_page(config["trends_kb"] * 1024)
+    servers["images"].image = padded_jpeg(config["image_kb"] * 1024)
+    servers["catalog"].catalog = json.dumps([
+        {"image_url": f"{urls['images']}/img/{i}.jpg", "topic": f"Landscaped garden number {i // 4}"}
+        for i in range(config["catalog_size"])
+    ]).encode("utf-8")
+    servers["gemini"].gemini_chars = config["gemini_chars"]
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection.send(urls)
+    while True:
+        command = connection.recv()
+        if command == "stats":
+            connection.send({
+                service: {"requests": server.requests, "injected_errors": server.errors}
+                for service, server in servers.items()
+            })
+        else:
+            break
+    for server in servers.values():
+        server.shutdown()
+
+
+def stand_in_environment(urls, data_dir, config):
+    """
+    Returns the environment that points main.py at the stand-in servers, with its caches,
+    outbox and content bank in data_dir and fake credentials for every service.
+    """
+    return {
+        "GRAPH_API_URL": f"{urls['graph']}/v19.0",
+        "TWITTER_API_URL": urls["x"],
+        "GEMINI_API_ENDPOINT": urls["gemini"],
+        "GEMINI_API_KEY": "benchmark-key",
+        "TRENDS_URL": f"{urls['trends']}/kenya/",
+        "IMAGE_URLS_URL": f"{urls['catalog']}/photos.json",
+        "FACEBOOK_PAGE_ID": "100000000000001",
+        "FACEBOOK_ACCESS_TOKEN": "benchmark-page-token",
+        "TWITTER_API_KEY": "benchmark",
+        "TWITTER_API_SECRET": "benchmark",
+        "TWITTER_ACCESS_TOKEN": "benchmark",
+        "TWITTER_ACCESS_TOKEN_SECRET": "benchmark",
+        "IMAGE_CACHE_DIR": os.path.join(data_dir, "image_cache"),
+        "TRENDS_CACHE_PATH": os.path.join(data_dir, "trends_cache.json"),
+        "OUTBOX_PATH": os.path.join(data_dir, "outbox.db"),
+        "CONTENT_BANK_PATH": os.path.join(data_dir, "content_bank.db"),
+        "GEMINI_CACHE_PATH": os.path.join(data_dir, "gemini_cache.db"),
+        "IMAGE_CATALOG_PATH": os.path.join(data_dir, "image_catalog.db"),
+        "DUPLICATE_INDEX_PATH": os.path.join(data_dir, "published_posts.db"),
+        "TRENDS_TTL_SECONDS": str(config["trends_ttl"]),
+        "TRENDS_MAX_STALE_SECONDS": str(config["trends_max_stale"]),
+        "ACCOUNTS_FILE": "",
+        "CYCLE_ID": "",
+        "TRAFFIC_MODE": "",
+    }
+
+
+# --- Scenarios ---
+# A scenario's setup runs once (untimed) after main.py is imported and returns the call
+# to time; the call gets the iteration number and returns a truthy value on success.
+def setup_cycle(main):
+    account = main.default_account()
+    run_id = time.strftime("%Y%m%d%H%M%S")
+
+    def cycle(i):
+        # A new cycle id per call, so the outbox never short-circuits a cycle
+        result = main.send_social_media_post(account, cycle_id=f"benchmark-{run_id}-{i}")
+        return result["facebook"] and result["twitter"]
+
+    return cycle
+
+
+def setup_catalog(main):
+    return lambda i: main.fetch_image_urls()
+
+
+def setup_download_image(main):
+    catalog = main.get_image_urls()
+    return lambda i: main.download_image(catalog[i % len(catalog)]["image_url"])
+
+
+def setup_prepare_image(main):
+    catalog = main.get_image_urls()
+
+    def prepare(i):
+        images = main.download_and_prepare_image(catalog[i % len(catalog)]["image_url"])
+        if images:
+            main.close_images(images)
+        return images
+
+    return prepare
+
+
+def setup_trends(main):
+    return lambda i: main.get_kenya_trends()
+
+
+def setup_hashtags(main):
+    message = ("Transform your outdoor space with Ecogreen Contractors! Expert landscaping, lawns and "
+               "walkways across Nairobi. Visit https://ecogreencontractors.solutions or WhatsApp us today. ")
+    trends = FAKE_TRENDS[:6]
+    return lambda i: main.append_hashtags_to_message(message, trends)
+
+
+def setup_gemini_twitter(main):
+    return lambda i: main.generate_twitter_ai_content(main.TOPICS[i % len(main.TOPICS)])
+
+
+def setup_gemini_facebook(main):
+    return lambda i: main.generate_facebook_ai_content(main.TOPICS[i % len(main.TOPICS)])
+
+
+def setup_post_facebook(main):
+    return lambda i: main.post_to_facebook(f"Benchmark post {i}")
+
+
+def setup_post_twitter(main):
+    return lambda i: main.post_to_twitter(f"Benchmark tweet {i}")
+
+
+def prepared_images(main):
+    images = main.download_and_prepare_image(main.get_image_urls()[0]["image_url"])
+    if not images:
+        raise RuntimeError("Could not download the benchmark image from the stand-in image host.")
+    return images
+
+
+def setup_post_image_facebook(main):
+    image = prepared_images(main)["facebook"]
+    return lambda i: main.post_image_to_facebook_page(image, f"Benchmark photo {i}")
+
+
+def setup_post_image_twitter(main):
+    image = prepared_images(main)["twitter"]
+    return lambda i: main.post_image_to_twitter(image, f"Benchmark image tweet {i}")
+
+
+def setup_post_carousel_facebook(main):
+    images = [prepared_images(main)["facebook"]] * 4
+    return lambda i: main.post_images_to_facebook_page(images, f"Benchmark carousel {i}")
+
+
+def setup_post_carousel_twitter(main):
+    images = [prepared_images(main)["twitter"]] * 4
+    return lambda i: main.post_images_to_twitter(images, f"Benchmark carousel tweet {i}")
+
+
+SCENARIOS = {
+    "cycle": setup_cycle,
+    "catalog": setup_catalog,
+    "download_image": setup_download_image,
+    "prepare_image": setup_prepare_image,
+    "trends": setup_trends,
+    "hashtags": setup_hashtags,
+    "gemini_twitter": setup_gemini_twitter,
+    "gemini_facebook": setup_gemini_facebook,
+    "post_facebook": setup_post_facebook,
+    "post_twitter": setup_post_twitter,
+    "post_image_facebook": setup_post_image_facebook,
+    "post_image_twitter": setup_post_image_twitter,
+    "post_carousel_facebook": setup_post_carousel_facebook,
+    "post_carousel_twitter": setup_post_carousel_twitter,
+}
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_worker(scenario, config, result_path):
+    """
+    Runs one scenario in this (fresh) interpreter and writes its measurements to result_path.
+    """
+    random.seed(config["seed"])
+    start = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - start
+    call = SCENARIOS[scenario](main)
+
+    def timed(i):
+        call_start = time.perf_counter()
+        try:
+            ok = bool(call(i))
+        except Exception as e:
+            print(f"{scenario} iteration {i} raised: {e}", file=sys.stderr)
+            ok = False
+        return time.perf_counter() - call_start, ok
+
+    for i in range(config["warmup"]):
+        timed(-1 - i)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config["concurrency"]) as executor:
+        samples = list(executor.map(timed, range(config["iterations"])))
+    wall = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in samples)
+    result = {
+        "scenario": scenario,
+        "calls": len(samples),
+        "ok": sum(1 for _, ok in samples if ok),
+        "wall_seconds": round(wall, 3),
+        "throughput_per_second": round(len(samples) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "import_seconds": round(import_seconds, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rate_limits": main.rate_limiter.report(),
+    }
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+# --- Main Execution Block ---
+def parse_service_values(values, defaults, convert):
+    """
+    Applies SERVICE=VALUE overrides (e.g. "gemini=1200") on top of the per-service defaults.
+    """
+    result = dict(defaults)
+    for value in values or []:
+        service, _, number = value.partition("=")
+        if service not in SERVICES or not number:
+            raise SystemExit(f"Expected SERVICE=VALUE with SERVICE one of {', '.join(SERVICES)}, got {value!r}")
+        result[service] = convert(number)
+    return result
+
+
+def print_results(results, stand_in_stats):
+    print(f"\n{'scenario':<22}{'calls':>7}{'ok':>7}{'calls/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}")
+    for result in results:
+        print(f"{result['scenario']:<22}{result['calls']:>7}{result['ok']:>7}"
+              f"{result['throughput_per_second']:>10.2f}{result['p50_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}{result['peak_rss_mb']:>13.1f}")
+    print("\nStand-in server requests:")
+    for service, stats in stand_in_stats.items():
+        print(f"  {service:<10}{stats['requests']:>7} requests, {stats['injected_errors']} injected errors")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark main.py against local stand-in servers.")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"scenarios to run (default: all): {', '.join(SCENARIOS)}")
+    parser.add_argument("--iterations", type=int, default=20, help="timed calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="calls in flight at once")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed calls before each scenario")
+    parser.add_argument("--seed", type=int, default=17, help="seed for topic/image choice, latency jitter and errors")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplies every service latency (0 for none)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="extra random latency as a fraction of the service latency")
+    parser.add_argument("--service-latency", action="append", metavar="SERVICE=MS", help="latency of one service")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--service-error-rate", action="append", metavar="SERVICE=RATE", help="error rate of one service")
+    parser.add_argument("--image-kb", type=int, default=300, help="size of the served images")
+    parser.add_argument("--trends-kb", type=int, default=150, help="size of the served trends page")
+    parser.add_argument("--gemini-chars", type=int, default=600, help="length of the generated texts")
+    parser.add_argument("--catalog-size", type=int, default=20, help="number of images in the catalog")
+    parser.add_argument("--trends-ttl", type=int, default=0, help="TRENDS_TTL_SECONDS for the run")
+    parser.add_argument("--trends-max-stale", type=int, default=0, help="TRENDS_MAX_STALE_SECONDS for the run")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show main.py's output")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_worker(args.worker, json.loads(os.environ["BENCHMARK_CONFIG"]), args.result)
+
+    latency_ms = parse_service_values(args.service_latency, DEFAULT_LATENCY_MS, float)
+    config = {
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "warmup": args.warmup,
+        "seed": args.seed,
+        "jitter": args.jitter,
+        "latency_ms": {service: ms * args.latency_scale for service, ms in latency_ms.items()},
+        "error_rate": parse_service_values(args.service_error_rate, dict.fromkeys(SERVICES, args.error_rate), float),
+        "image_kb": args.image_kb,
+        "trends_kb": args.trends_kb,
+        "gemini_chars": args.gemini_chars,
+        "catalog_size": args.catalog_size,
+        "trends_ttl": args.trends_ttl,
+        "trends_max_stale": args.trends_max_stale,
+    }
+    scenarios = args.scenarios or list(SCENARIOS)
+    unknown = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    parent_connection, child_connection = multiprocessing.Pipe()
+    stand_ins = multiprocessing.Process(target=serve_stand_ins, args=(config, child_connection), daemon=True)
+    stand_ins.start()
+    urls = parent_connection.recv()
+    print(f"Stand-in servers: {', '.join(f'{service}={url}' for service, url in urls.items())}")
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    results = []
+    try:
+        for scenario in scenarios:
+            data_dir = os.path.join(work_dir, scenario)
+            os.makedirs(data_dir)
+            result_path = os.path.join(data_dir, "result.json")
+            env = dict(os.environ, **stand_in_environment(urls, data_dir, config), BENCHMARK_CONFIG=json.dumps(config))
+            print(f"Running {scenario}: {args.iterations} calls, {args.concurrency} at a time...")
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", scenario, "--result", result_path],
+                env=env,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=None if args.verbose else subprocess.DEVNULL,
+            )
+            if completed.returncode != 0 or not os.path.exists(result_path):
+                print(f"Scenario {scenario} failed (exit code {completed.returncode}).")
+                continue
+            with open(result_path) as f:
+                results.append(json.load(f))
+        parent_connection.send("stats")
+        stand_in_stats = parent_connection.recv()
+    finally:
+        parent_connection.send("stop")
+        stand_ins.join(timeout=5)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results, stand_in_stats)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": config, "results": results, "stand_ins": stand_in_stats}, f, indent=2)
+        print(f"Results written to {args.json}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -3,40 +3,998 @@ import os
 import random
 import time
 import requests
-import google.generativeai as genai
 from dotenv import load_dotenv
- # schedule module no longer needed
-from requests_oauthlib import OAuth1Session
-import requests
-from bs4 import BeautifulSoup
-import time # To add delays and avoid being blocked
+from requests.adapters import HTTPAdapter
+# google.generativeai, bs4, requests_oauthlib, PIL and schedule are imported
+# lazily by the code paths that need them (see get_model and startup_report)
+import argparse
+import contextvars
+import fcntl
+import functools
+import hashlib
+import io
+import itertools
+import json
+import mimetypes
+import mmap
+import re
+import signal
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import unicodedata
+import zlib
+from contextlib import closing, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlencode, urlsplit
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 
 # --- Image Posting Logic ---
 # Load environment variables from .env before any os.getenv calls
 load_dotenv()
 
+# --- HTTP Transport ---
+# Every outbound call goes through http_request(), which keeps one pooled
+# requests.Session per host (keep-alive, so TLS handshakes to graph.facebook.com
+# and api.x.com are reused), always applies connect/read timeouts and retries
+# idempotent calls on connection errors and 5xx/429 responses with jittered backoff.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "10"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """
+    Returns the shared requests.Session for the host of the given URL,
+    creating it (with a sized connection pool) on first use.
+    """
+    host = urlsplit(url).netloc.lower()
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Full-jitter exponential backoff. A numeric Retry-After header, when given, is used as the minimum.
+    """
+    delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), HTTP_BACKOFF_MAX))
+        except ValueError:
+            pass
+    return delay
+
+
+def http_request(method, url, retry=None, timeout=None, rate_limit_keys=None, priority=0, **kwargs):
+    """
+    Sends a request over the pooled session for the URL's host.
+    retry defaults to True for idempotent methods only, so a POST that creates a post is never sent twice.
+    With rate_limit_keys, every attempt first waits for capacity in the rate limiter
+    (see RateLimitScheduler) and its response headers update the limiter.
+    Raises requests.exceptions.RequestException if the last attempt fails to connect.
+    """
+    method = method.upper()
+    if retry is None:
+        retry = method in IDEMPOTENT_METHODS
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    attempts = HTTP_MAX_RETRIES + 1 if retry else 1
+    session = get_session(url)
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        if rate_limit_keys:
+            rate_limiter.acquire(rate_limit_keys, priority)
+        try:
+            response = send_request(session, method, url, timeout=timeout, **kwargs)
+            if rate_limit_keys:
+                rate_limiter.observe(rate_limit_keys, response)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if last_attempt:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{method} {urlsplit(url).netloc} failed ({e}). Retrying in {delay:.2f}s...")
+            count_metric("http_retries", host=urlsplit(url).netloc)
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                return response
+            delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+            print(f"{method} {urlsplit(url).netloc} returned {response.status_code}. Retrying in {delay:.2f}s...")
+            count_metric("http_retries", host=urlsplit(url).netloc)
+            response.close()
+        time.sleep(delay)
+
+
+def http_get(url, **kwargs):
+    return http_request("GET", url, **kwargs)
+
+
+def http_post(url, **kwargs):
+    return http_request("POST", url, **kwargs)
+
+
+# --- Metrics ---
+# Each stage of a post cycle is timed as a span (see traced()) and HTTP retries, cache
+# hits/misses and stage failures are counted (see count_metric()). With METRICS_LOG_PATH
+# set, every span and counter increment is appended to that file as a JSON line, tagged
+# with the cycle it belongs to. METRICS_TEXTFILE_PATH is rewritten in the Prometheus text
+# format after every cycle (for node_exporter's textfile collector), and the daemon serves
+# the same text on /metrics. LOG_PAYLOADS=false stops the full API response dumps.
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH")
+METRICS_TEXTFILE_PATH = os.getenv("METRICS_TEXTFILE_PATH")
+METRICS_PREFIX = "social_media"
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "true").lower() in ("1", "true", "yes")
+
+current_cycle = contextvars.ContextVar("current_cycle", default=None)
+_metrics_lock = threading.Lock()
+_metrics_log = None
+_counters = {}
+_span_totals = {}
+
+
+def log_payload(label, payload):
+    """
+    Prints a raw API response (or other large payload) unless LOG_PAYLOADS is off.
+    """
+    if LOG_PAYLOADS:
+        print(label, payload)
+
+
+def write_metrics_event(event):
+    global _metrics_log
+    if not METRICS_LOG_PATH:
+        return
+    event = dict(event, ts=round(time.time(), 3), cycle=current_cycle.get())
+    line = json.dumps(event, default=str) + "\n"
+    with _metrics_lock:
+        if _metrics_log is None:
+            _metrics_log = open(METRICS_LOG_PATH, "a", buffering=1)
+        _metrics_log.write(line)
+
+
+def count_metric(name, amount=1, **labels):
+    """
+    Adds amount to the counter name{labels}, e.g. count_metric("cache_hits", cache="image").
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    write_metrics_event({"type": "counter", "name": name, "labels": labels, "amount": amount})
+
+
+def record_span(name, seconds, ok, **labels):
+    with _metrics_lock:
+        totals = _span_totals.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+    write_metrics_event({"type": "span", "name": name, "seconds": round(seconds, 6), "ok": ok, "labels": labels})
+    if not ok:
+        count_metric("stage_failures", stage=name)
+
+
+@contextmanager
+def span(name, **labels):
+    """
+    Times the enclosed block as a span. The block can set span_state["ok"] = False to
+    record a failure without raising; an exception also marks the span failed.
+    """
+    span_state = {"ok": True}
+    start = time.perf_counter()
+    try:
+        yield span_state
+    except BaseException:
+        span_state["ok"] = False
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, span_state["ok"], **labels)
+
+
+def traced(name, ok=bool):
+    """
+    Decorator that records every call of a function as a span. The call counts as failed
+    if it raises or if ok(result) is false (by default: the function returned a falsy value).
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as span_state:
+                result = func(*args, **kwargs)
+                span_state["ok"] = bool(ok(result))
+                return result
+        return wrapper
+    return decorate
+
+
+def prometheus_metrics():
+    """
+    Returns the counters and span totals in the Prometheus text exposition format.
+    """
+    def format_labels(labels):
+        if not labels:
+            return ""
+        pairs = []
+        for name, value in labels:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            pairs.append(f'{name}="{value}"')
+        return "{" + ",".join(pairs) + "}"
+
+    with _metrics_lock:
+        counters = sorted(_counters.items())
+        span_totals = sorted(_span_totals.items())
+    lines = [
+        f"# HELP {METRICS_PREFIX}_stage_duration_seconds Time spent in each post cycle stage.",
+        f"# TYPE {METRICS_PREFIX}_stage_duration_seconds summary",
+    ]
+    for name, (calls, seconds) in span_totals:
+        lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_count{{stage="{name}"}} {calls}')
+        lines.append(f'{METRICS_PREFIX}_stage_duration_seconds_sum{{stage="{name}"}} {seconds:.6f}')
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+        lines.append(f"{METRICS_PREFIX}_{name}_total{format_labels(labels)} {value}")
+    lines.append(f"# TYPE {METRICS_PREFIX}_metrics_written_timestamp_seconds gauge")
+    lines.append(f"{METRICS_PREFIX}_metrics_written_timestamp_seconds {time.time():.0f}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_textfile():
+    """
+    Rewrites METRICS_TEXTFILE_PATH (if set) with the current metrics.
+    """
+    if METRICS_TEXTFILE_PATH:
+        try:
+            atomic_write(METRICS_TEXTFILE_PATH, prometheus_metrics().encode("utf-8"))
+        except OSError as e:
+            print(f"Could not write metrics to {METRICS_TEXTFILE_PATH}: {e}")
+
+
+# --- Traffic Recording ---
+# With TRAFFIC_MODE=record, every outbound call (the HTTP requests made through
+# http_request() and Gemini's generate_content) is stored with its timing in a cassette:
+# a SQLite file at TRAFFIC_CASSETTE_PATH. Response bodies are zlib-compressed and stored
+# once per distinct body, and request bodies, query strings and credentials are never
+# stored. With TRAFFIC_MODE=replay, nothing leaves the host: each call is answered from the
+# cassette by its route (method, host and path, with long numeric IDs folded together),
+# cycling through the recorded responses of that route, after the recorded latency divided
+# by TRAFFIC_REPLAY_SPEED (1 is the original timing, 0 replays without delay). A GET for a
+# file that was never recorded (say, another image of the catalog) is answered with a
+# recorded file from the same directory of the host. The cassette is opened read-only for
+# replay, so any number of processes can share it (see load-test).
+TRAFFIC_MODE = os.getenv("TRAFFIC_MODE", "").lower()
+TRAFFIC_CASSETTE_PATH = os.getenv("TRAFFIC_CASSETTE_PATH", "traffic_cassette.db")
+TRAFFIC_REPLAY_SPEED = float(os.getenv("TRAFFIC_REPLAY_SPEED", "1"))
+UNRECORDED_HEADERS = {"set-cookie", "content-encoding", "transfer-encoding", "connection"}
+
+_cassette_local = threading.local()
+_cassette_routes = None
+_cassette_routes_lock = threading.Lock()
+_replay_counters = {}
+
+
+class ReplayMissError(requests.exceptions.RequestException):
+    """
+    Raised in replay mode for a call the cassette has no recording for (never retried).
+    """
+
+
+def open_cassette():
+    """
+    Returns this thread's connection to the cassette, read-only in replay mode.
+    Recording creates the tables on first use; concurrent recorders share the file through
+    SQLite's write-ahead log.
+    """
+    conn = getattr(_cassette_local, "conn", None)
+    if conn is None:
+        if TRAFFIC_MODE == "replay":
+            conn = sqlite3.connect(f"file:{TRAFFIC_CASSETTE_PATH}?mode=ro", uri=True, timeout=30)
+        else:
+            conn = sqlite3.connect(TRAFFIC_CASSETTE_PATH, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS interactions ("
+                "id INTEGER PRIMARY KEY, route TEXT NOT NULL, url TEXT NOT NULL, request_bytes INTEGER, "
+                "status INTEGER NOT NULL, headers TEXT NOT NULL, body_hash TEXT NOT NULL, "
+                "elapsed REAL NOT NULL, recorded_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS bodies (hash TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS interactions_route ON interactions (route)")
+        _cassette_local.conn = conn
+    return conn
+
+
+def traffic_route(method, url, headers=None):
+    """
+    The key recorded calls are replayed by: method, host (without port) and path, with
+    numeric IDs of 5+ digits replaced, plus "conditional" for requests with validators.
+    """
+    parts = urlsplit(url)
+    path = re.sub(r"\d{5,}", "{id}", parts.path)
+    conditional = any(name.lower() in ("if-none-match", "if-modified-since") for name in headers or {})
+    return f"{method} {parts.hostname}{path}{' conditional' if conditional else ''}"
+
+
+def traffic_route_directory(route):
+    """
+    The route of any file in the same directory, for GET routes ("GET host/dir/*"), else None.
+    """
+    if not route.startswith("GET ") or route.endswith(" conditional"):
+        return None
+    return route.rsplit("/", 1)[0] + "/*"
+
+
+def record_interaction(route, url, request_bytes, status, headers, body, elapsed):
+    body_hash = hashlib.sha256(body).hexdigest()
+    headers = {name: value for name, value in headers.items() if name.lower() not in UNRECORDED_HEADERS}
+    try:
+        conn = open_cassette()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO bodies VALUES (?, ?)", (body_hash, zlib.compress(body, 6)))
+            conn.execute(
+                "INSERT INTO interactions (route, url, request_bytes, status, headers, body_hash, elapsed, "
+                "recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (route, urlsplit(url)._replace(query="", fragment="").geturl(), request_bytes, status,
+                 json.dumps(headers), body_hash, elapsed, time.time()),
+            )
+    except sqlite3.Error as e:
+        print(f"Could not record {route} in {TRAFFIC_CASSETTE_PATH}: {e}")
+
+
+@functools.lru_cache(maxsize=32)
+def cassette_body(body_hash):
+    row = open_cassette().execute("SELECT data FROM bodies WHERE hash = ?", (body_hash,)).fetchone()
+    return zlib.decompress(row[0])
+
+
+def replay_interaction(route):
+    """
+    Returns the next recorded (status, headers, body, elapsed) for the route, going round
+    the route's recordings in order, or None if the route was never recorded.
+    """
+    global _cassette_routes
+    with _cassette_routes_lock:
+        if _cassette_routes is None:
+            _cassette_routes = {}
+            for recorded_route, interaction_id in open_cassette().execute(
+                "SELECT route, id FROM interactions ORDER BY id"
+            ):
+                _cassette_routes.setdefault(recorded_route, []).append(interaction_id)
+                directory = traffic_route_directory(recorded_route)
+                if directory:
+                    _cassette_routes.setdefault(directory, []).append(interaction_id)
+        interaction_ids = _cassette_routes.get(route)
+        if not interaction_ids:
+            return None
+        counter = _replay_counters.setdefault(route, itertools.count())
+        interaction_id = interaction_ids[next(counter) % len(interaction_ids)]
+    status, headers, body_hash, elapsed = open_cassette().execute(
+        "SELECT status, headers, body_hash, elapsed FROM interactions WHERE id = ?", (interaction_id,)
+    ).fetchone()
+    return status, json.loads(headers), cassette_body(body_hash), elapsed
+
+
+def replay_delay(elapsed):
+    if TRAFFIC_REPLAY_SPEED > 0:
+        time.sleep(elapsed / TRAFFIC_REPLAY_SPEED)
+
+
+def send_request(session, method, url, **kwargs):
+    """
+    Sends one HTTP request over session, recording it or answering it from the cassette
+    depending on TRAFFIC_MODE.
+    """
+    if TRAFFIC_MODE == "replay":
+        route = traffic_route(method, url, kwargs.get("headers"))
+        # A recorded unconditional response is a valid answer to a conditional request
+        unconditional = route.removesuffix(" conditional")
+        replayed = None
+        for candidate in dict.fromkeys(filter(None, (route, unconditional, traffic_route_directory(unconditional)))):
+            replayed = replay_interaction(candidate)
+            if replayed is not None:
+                break
+        if replayed is None:
+            count_metric("traffic_replay_misses")
+            raise ReplayMissError(f"No recorded response for {route} in {TRAFFIC_CASSETTE_PATH}")
+        status, headers, body, elapsed = replayed
+        replay_delay(elapsed)
+        response = requests.Response()
+        response.status_code = status
+        response.reason = "Replayed"
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response.url = url
+        response.request = requests.Request(method, url).prepare()
+        return response
+    if TRAFFIC_MODE != "record":
+        return session.request(method, url, **kwargs)
+    start = time.perf_counter()
+    response = session.request(method, url, **kwargs)
+    body = response.content
+    request_body = response.request.body or b""
+    record_interaction(
+        traffic_route(method, url, kwargs.get("headers")), url, len(request_body), response.status_code,
+        response.headers, body, time.perf_counter() - start,
+    )
+    return response
+
+
+class ReplayedGeminiResponse:
+    """
+    Stands in for a Gemini response (or streamed chunk) carrying a recorded text.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))]
+
+
+class CassetteModel:
+    """
+    Wraps the Gemini model (None when replaying) so generate_content is recorded to or
+    replayed from the cassette. A streamed response is recorded chunk by chunk with the
+    time each chunk arrived, and replayed with the same spacing.
+    """
+
+    def __init__(self, model=None):
+        self.model = model
+
+    @staticmethod
+    def route(stream, kwargs):
+        generation_config = kwargs.get("generation_config") or {}
+        mime_type = generation_config.get("response_mime_type") if isinstance(generation_config, dict) else None
+        return f"GEMINI generate_content{' stream' if stream else ''}{f' {mime_type}' if mime_type else ''}"
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        route = self.route(stream, kwargs)
+        if self.model is None:
+            replayed = replay_interaction(route)
+            if replayed is None:
+                count_metric("traffic_replay_misses")
+                raise ReplayMissError(f"No recorded response for {route} in {TRAFFIC_CASSETTE_PATH}")
+            chunks = json.loads(replayed[2])
+            if stream:
+                return self.replay_stream(chunks)
+            replay_delay(replayed[3])
+            return ReplayedGeminiResponse("".join(text for _, text in chunks))
+        start = time.perf_counter()
+        response = self.model.generate_content(prompt, stream=stream, **kwargs)
+        if stream:
+            return self.record_stream(route, prompt, response, start)
+        try:
+            text = response.text
+        except ValueError:
+            text = ""
+        elapsed = time.perf_counter() - start
+        record_interaction(route, "gemini:generate_content", len(prompt), 200, {},
+                           json.dumps([[elapsed, text]]).encode("utf-8"), elapsed)
+        return response
+
+    @staticmethod
+    def replay_stream(chunks):
+        start = time.perf_counter()
+        for offset, text in chunks:
+            if TRAFFIC_REPLAY_SPEED > 0:
+                time.sleep(max(0.0, offset / TRAFFIC_REPLAY_SPEED - (time.perf_counter() - start)))
+            yield ReplayedGeminiResponse(text)
+
+    @staticmethod
+    def record_stream(route, prompt, response, start):
+        chunks = []
+        try:
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    text = ""
+                chunks.append([time.perf_counter() - start, text])
+                yield chunk
+        finally:
+            # A stream the caller stopped reading early is recorded as far as it was read
+            if chunks:
+                record_interaction(route, "gemini:generate_content", len(prompt), 200, {},
+                                   json.dumps(chunks).encode("utf-8"), chunks[-1][0])
+
+
+# --- Rate Limiting ---
+# Calls to X and the Graph API pass rate-limit keys to http_request(). The scheduler keeps
+# one bucket per key, filled from the usage headers of every response:
+#   ("x", endpoint, account)      x-rate-limit-limit / -remaining / -reset
+#   ("facebook-app",)             X-App-Usage
+#   ("facebook-page", page_id)    X-Page-Usage / X-Business-Use-Case-Usage
+# Calls are spaced out once a bucket runs low and held until the reset once it is empty,
+# so requests are not rejected with 429. Waiting calls are released in priority order.
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "120"))
+# Start spacing out X calls when less than this fraction of the window's limit remains
+RATE_LIMIT_PACE_FRACTION = float(os.getenv("RATE_LIMIT_PACE_FRACTION", "0.25"))
+# Graph API usage (percent) above which calls are slowed down, and the delay at 100%
+FACEBOOK_USAGE_SLOWDOWN = float(os.getenv("FACEBOOK_USAGE_SLOWDOWN", "75"))
+FACEBOOK_USAGE_MAX_DELAY = float(os.getenv("FACEBOOK_USAGE_MAX_DELAY", "60"))
+
+
+class RateLimitExceeded(requests.exceptions.RequestException):
+    """Raised when a call would have to wait longer than RATE_LIMIT_MAX_WAIT_SECONDS."""
+
+
+class RateLimitBucket:
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.next_slot = 0.0
+        self.usage = 0.0
+        self.calls = 0
+        self.waited_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def ready_at(self, now):
+        ready = self.next_slot
+        if self.remaining is not None and self.remaining <= 0 and self.reset_at > now:
+            ready = max(ready, self.reset_at)
+        return max(now, ready)
+
+    def consume(self, now):
+        self.calls += 1
+        if self.remaining is not None:
+            if self.reset_at <= now:
+                self.remaining = self.limit
+            if self.remaining is not None:
+                self.remaining -= 1
+        if self.remaining is not None and self.limit and self.reset_at > now \
+                and self.remaining < self.limit * RATE_LIMIT_PACE_FRACTION:
+            # Spread the calls left in this window evenly until it resets
+            self.next_slot = now + (self.reset_at - now) / (self.remaining + 1)
+        elif self.usage >= FACEBOOK_USAGE_SLOWDOWN:
+            slowdown = (self.usage - FACEBOOK_USAGE_SLOWDOWN) / (100 - FACEBOOK_USAGE_SLOWDOWN)
+            self.next_slot = now + FACEBOOK_USAGE_MAX_DELAY * min(1.0, slowdown)
+
+
+class RateLimitScheduler:
+    """
+    Token buckets per rate-limit key, driven by X and Graph API response headers.
+    acquire() blocks until every bucket of a call has capacity; observe() updates the
+    buckets from a response.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._buckets = {}
+        self._waiters = []
+        self._tickets = itertools.count()
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = RateLimitBucket()
+        return bucket
+
+    def acquire(self, keys, priority=0, max_wait=None):
+        """
+        Waits until the call may be sent and returns the time spent waiting.
+        Among waiting calls that share a key and can go, lower priority values go first, then
+        arrival order; a call still waiting on one of its other buckets does not hold the rest back.
+        Raises RateLimitExceeded if the wait would exceed max_wait.
+        """
+        max_wait = RATE_LIMIT_MAX_WAIT_SECONDS if max_wait is None else max_wait
+        keys = [tuple(key) for key in keys]
+        ticket = (priority, next(self._tickets))
+        start = time.monotonic()
+        with self._condition:
+            waiter = (ticket, set(keys))
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    now = time.time()
+                    buckets = [self._bucket(key) for key in keys]
+                    ready_at = max(bucket.ready_at(now) for bucket in buckets)
+                    # An earlier call only holds this one back while it can go itself: one
+                    # stalled on its own exhausted bucket (a page at its limit) must not stall
+                    # every call that merely shares a bucket with it (the app-wide Graph one)
+                    ahead = any(
+                        other_ticket < ticket and other_keys & waiter[1]
+                        and all(self._bucket(key).ready_at(now) <= now for key in other_keys)
+                        for other_ticket, other_keys in self._waiters
+                    )
+                    if ready_at <= now and not ahead:
+                        break
+                    waited = time.monotonic() - start
+                    if waited + (ready_at - now) > max_wait:
+                        raise RateLimitExceeded(
+                            f"Rate limit for {', '.join(map(format_rate_limit_key, keys))} "
+                            f"resets in {ready_at - now:.0f}s"
+                        )
+                    self._condition.wait(timeout=max(0.05, ready_at - now))
+                waited = time.monotonic() - start
+                for bucket in buckets:
+                    bucket.consume(now)
+                    bucket.waited_seconds += waited
+                    bucket.max_wait_seconds = max(bucket.max_wait_seconds, waited)
+            finally:
+                self._waiters.remove(waiter)
+                self._condition.notify_all()
+        if waited >= 0.01:
+            print(f"Waited {waited:.2f}s in the rate-limit queue for {', '.join(map(format_rate_limit_key, keys))}.")
+        return waited
+
+    def observe(self, keys, response):
+        """
+        Updates the buckets of a call from the rate-limit headers of its response.
+        """
+        headers = response.headers
+        now = time.time()
+        with self._condition:
+            for key in keys:
+                key = tuple(key)
+                bucket = self._bucket(key)
+                if key[0] == "x" and "x-rate-limit-remaining" in headers:
+                    try:
+                        bucket.limit = int(headers.get("x-rate-limit-limit") or 0) or None
+                        bucket.remaining = int(headers["x-rate-limit-remaining"])
+                        bucket.reset_at = float(headers.get("x-rate-limit-reset") or 0)
+                    except ValueError:
+                        pass
+                elif key[0] == "facebook-app":
+                    bucket.usage = facebook_usage_percent(headers.get("X-App-Usage"))[0]
+                elif key[0] == "facebook-page":
+                    page_usage, _ = facebook_usage_percent(headers.get("X-Page-Usage"))
+                    business_usage, regain_minutes = facebook_usage_percent(headers.get("X-Business-Use-Case-Usage"))
+                    bucket.usage = max(page_usage, business_usage)
+                    if bucket.usage >= 100:
+                        bucket.remaining, bucket.reset_at = 0, now + 60 * (regain_minutes or 5)
+                if response.status_code == 429 and (bucket.remaining is None or bucket.remaining > 0):
+                    # Rejected without usable headers: back off for Retry-After (or a minute)
+                    try:
+                        retry_after = float(headers.get("Retry-After") or 60)
+                    except ValueError:
+                        retry_after = 60.0
+                    bucket.remaining, bucket.reset_at = 0, max(bucket.reset_at, now + retry_after)
+            self._condition.notify_all()
+
+    def report(self):
+        """
+        Returns per-key call counts, queue wait times and the last known remaining quota.
+        """
+        with self._condition:
+            return {
+                format_rate_limit_key(key): {
+                    "calls": bucket.calls,
+                    "waited_seconds": round(bucket.waited_seconds, 3),
+                    "max_wait_seconds": round(bucket.max_wait_seconds, 3),
+                    "remaining": bucket.remaining,
+                    "usage_percent": bucket.usage,
+                }
+                for key, bucket in self._buckets.items()
+            }
+
+
+def format_rate_limit_key(key):
+    return ":".join(str(part) for part in key)
+
+
+def facebook_usage_percent(header_value):
+    """
+    Returns (highest usage percentage, estimated minutes to regain access) from a Graph API
+    X-App-Usage, X-Page-Usage or X-Business-Use-Case-Usage header value.
+    """
+    if not header_value:
+        return 0.0, 0
+    try:
+        usage = json.loads(header_value)
+    except ValueError:
+        return 0.0, 0
+    # X-Business-Use-Case-Usage maps business IDs to lists of usage objects
+    entries = [usage] if isinstance(usage, dict) and "call_count" in usage else [
+        entry for entries in (usage.values() if isinstance(usage, dict) else []) for entry in entries
+    ]
+    highest, regain_minutes = 0.0, 0
+    for entry in entries:
+        for field in ("call_count", "total_time", "total_cputime"):
+            highest = max(highest, float(entry.get(field) or 0))
+        regain_minutes = max(regain_minutes, int(entry.get("estimated_time_to_regain_access") or 0))
+    return highest, regain_minutes
+
+
+rate_limiter = RateLimitScheduler()
+
+
+_twitter_auths = {}
+
+
+def twitter_auth(account=None):
+    """
+    Returns the OAuth1 signer for an account's Twitter credentials (the environment-configured
+    account by default). Each signer is created once and used with the pooled api.x.com
+    session instead of opening a new OAuth1Session per call.
+    """
+    account = account or default_account()
+    credentials = (
+        account.get("twitter_api_key"),
+        account.get("twitter_api_secret"),
+        account.get("twitter_access_token"),
+        account.get("twitter_access_token_secret"),
+    )
+    auth = _twitter_auths.get(credentials)
+    if auth is None:
+        from requests_oauthlib import OAuth1
+
+        auth = _twitter_auths[credentials] = OAuth1(
+            credentials[0],
+            client_secret=credentials[1],
+            resource_owner_key=credentials[2],
+            resource_owner_secret=credentials[3],
+        )
+    return auth
+
+
+def twitter_rate_limit_keys(endpoint, account=None):
+    # X limits are per endpoint and per authenticated user
+    return [("x", endpoint, (account or default_account())["name"])]
+
+
+def facebook_rate_limit_keys(account=None):
+    # Graph API limits are tracked per app (shared by all pages) and per page
+    return [("facebook-app",), ("facebook-page", (account or default_account()).get("facebook_page_id"))]
+
+
 # --- Image URLs Fetch Logic ---
 # If IMAGE_URLS_URL is set in the environment, fetch the JSON from that URL.
 # Otherwise, use the default list.
+# Catalogs are kept in a local SQLite index (IMAGE_CATALOG_PATH) together with what is
+# known about each image (byte size, format, dimensions, validation status). A catalog is
+# revalidated with If-None-Match/If-Modified-Since once it is older than
+# IMAGE_CATALOG_MAX_AGE_MINUTES (in the background while the indexed copy is served),
+# and only the entries that changed are applied. Images are picked with a shuffled cursor:
+# every catalog gets a random order and a cursor that moves through it, so no image repeats
+# before the whole catalog was used, and images known to be invalid are skipped.
 IMAGE_URLS_URL = os.getenv("IMAGE_URLS_URL", "https://raw.githubusercontent.com/Nduhiu17/marketing-snapshots/refs/heads/main/photos.json")
-IMAGE_URLS = []
-try:
-    response = requests.get(IMAGE_URLS_URL, timeout=10)
-    if response.status_code == 200:
-        IMAGE_URLS = response.json()
-        print(f"Fetched {len(IMAGE_URLS)} images from {IMAGE_URLS_URL}")
-    else:
-        print(f"Failed to fetch image URLs from {IMAGE_URLS_URL}, status code: {response.status_code}")
-except Exception as e:
-    print(f"Error fetching image URLs from {IMAGE_URLS_URL}: {e}")
-    # Fallback to default list if fetch fails
-    # IMAGE_URLS = [
-    #     {
-    #         "image_url": "https://ecogreencontractors.solutions/static/media/about1.1c4f9ffe16b2ddba4075.jpg",
-    #         "topic": "Outside garden with flowers and walk ways"
-    #     },
-    #     # Add more image dicts as needed
-    # ]
+IMAGE_CATALOG_PATH = os.getenv("IMAGE_CATALOG_PATH", "image_catalog.db")
+IMAGE_CATALOG_MAX_AGE_MINUTES = int(os.getenv("IMAGE_CATALOG_MAX_AGE_MINUTES", "60"))
+IMAGE_CATALOG_TIMEOUT = float(os.getenv("IMAGE_CATALOG_TIMEOUT", "10"))
+# Set CAROUSEL_MAX_IMAGES (at most 4, X's limit) above 1 to turn image posts into carousels:
+# the picked image plus the next images of the same topic in the catalog's shuffled order,
+# which the cursor then skips, so carousel images do not repeat before the next shuffle either.
+CAROUSEL_MAX_IMAGES = max(1, min(4, int(os.getenv("CAROUSEL_MAX_IMAGES", "1"))))
+
+_catalog_refreshes = set()
+_catalog_refreshes_lock = threading.Lock()
+
+
+def open_image_catalog():
+    """
+    Opens the image catalog index, creating the tables on first use.
+    """
+    conn = sqlite3.connect(IMAGE_CATALOG_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS catalogs ("
+        "catalog TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL, "
+        "cursor REAL NOT NULL DEFAULT -1)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS catalog_images ("
+        "catalog TEXT NOT NULL, image_url TEXT NOT NULL, topic TEXT, position REAL NOT NULL, "
+        "size INTEGER, format TEXT, width INTEGER, height INTEGER, valid INTEGER, "
+        "PRIMARY KEY (catalog, image_url))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS catalog_images_position ON catalog_images (catalog, position)")
+    conn.execute("CREATE INDEX IF NOT EXISTS catalog_images_url ON catalog_images (image_url)")
+    return conn
+
+
+def sync_catalog(conn, catalog, images):
+    """
+    Applies a fetched catalog (a list of {"image_url", "topic"} dicts) to the index:
+    new images are added at random positions of the shuffled order, removed ones are
+    deleted and changed topics updated. Metadata of unchanged images is kept.
+    Returns the number of changed entries.
+    """
+    fetched = {}
+    for image in images:
+        if isinstance(image, dict) and image.get("image_url"):
+            fetched[image["image_url"]] = image.get("topic")
+    indexed = dict(conn.execute("SELECT image_url, topic FROM catalog_images WHERE catalog = ?", (catalog,)))
+    added = [(catalog, url, topic, random.random()) for url, topic in fetched.items() if url not in indexed]
+    removed = [(catalog, url) for url in indexed if url not in fetched]
+    changed = [(topic, catalog, url) for url, topic in fetched.items() if url in indexed and indexed[url] != topic]
+    conn.executemany("INSERT INTO catalog_images (catalog, image_url, topic, position) VALUES (?, ?, ?, ?)", added)
+    conn.executemany("DELETE FROM catalog_images WHERE catalog = ? AND image_url = ?", removed)
+    conn.executemany("UPDATE catalog_images SET topic = ? WHERE catalog = ? AND image_url = ?", changed)
+    return len(added) + len(removed) + len(changed)
+
+
+def indexed_image_urls(catalog):
+    with closing(open_image_catalog()) as conn:
+        rows = conn.execute(
+            "SELECT image_url, topic FROM catalog_images WHERE catalog = ? ORDER BY rowid", (catalog,)
+        ).fetchall()
+    return [{"image_url": url, "topic": topic} for url, topic in rows]
+
+
+@traced("catalog_fetch", ok=lambda catalog: catalog is not None)
+def fetch_image_urls(catalog_url=None):
+    """
+    Fetches an image catalog (a list of {"image_url", "topic"} dicts), IMAGE_URLS_URL by default,
+    with a conditional request and applies the changes to the index.
+    Returns the catalog, or None if it could not be fetched.
+    """
+    catalog_url = catalog_url or IMAGE_URLS_URL
+    with closing(open_image_catalog()) as conn:
+        validators = conn.execute(
+            "SELECT etag, last_modified FROM catalogs WHERE catalog = ?", (catalog_url,)
+        ).fetchone()
+    headers = {}
+    if validators and validators[0]:
+        headers["If-None-Match"] = validators[0]
+    if validators and validators[1]:
+        headers["If-Modified-Since"] = validators[1]
+    try:
+        response = http_get(catalog_url, headers=headers, timeout=(HTTP_CONNECT_TIMEOUT, IMAGE_CATALOG_TIMEOUT))
+        if response.status_code == 304 and validators:
+            with closing(open_image_catalog()) as conn:
+                with conn:
+                    conn.execute("UPDATE catalogs SET fetched_at = ? WHERE catalog = ?", (time.time(), catalog_url))
+            print(f"Image catalog {catalog_url} not modified.")
+            return indexed_image_urls(catalog_url)
+        if response.status_code == 200:
+            image_urls = response.json()
+            with closing(open_image_catalog()) as conn:
+                with conn:
+                    changes = sync_catalog(conn, catalog_url, image_urls)
+                    conn.execute(
+                        "INSERT INTO catalogs (catalog, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (catalog) DO UPDATE SET etag = excluded.etag, "
+                        "last_modified = excluded.last_modified, fetched_at = excluded.fetched_at",
+                        (catalog_url, response.headers.get("ETag"), response.headers.get("Last-Modified"), time.time()),
+                    )
+            print(f"Fetched {len(image_urls)} images from {catalog_url} ({changes} changed)")
+            return image_urls
+        else:
+            print(f"Failed to fetch image URLs from {catalog_url}, status code: {response.status_code}")
+    except Exception as e:
+        print(f"Error fetching image URLs from {catalog_url}: {e}")
+    return None
+
+
+def refresh_image_urls():
+    """
+    Re-fetches every indexed image catalog (IMAGE_URLS_URL included), keeping the indexed
+    copy of any catalog whose fetch fails.
+    """
+    with closing(open_image_catalog()) as conn:
+        catalog_urls = [row[0] for row in conn.execute("SELECT catalog FROM catalogs WHERE catalog LIKE 'http%'")]
+    for catalog_url in dict.fromkeys([IMAGE_URLS_URL] + catalog_urls):
+        fetch_image_urls(catalog_url)
+
+
+def refresh_catalog_in_background(catalog_url):
+    with _catalog_refreshes_lock:
+        if catalog_url in _catalog_refreshes:
+            return
+        _catalog_refreshes.add(catalog_url)
+
+    def refresh():
+        try:
+            fetch_image_urls(catalog_url)
+        finally:
+            with _catalog_refreshes_lock:
+                _catalog_refreshes.discard(catalog_url)
+
+    threading.Thread(target=refresh, name="catalog-refresh", daemon=True).start()
+
+
+def ensure_image_catalog(catalog_url=None):
+    """
+    Makes sure a catalog is in the index: it is fetched on every use until a fetch succeeded,
+    then revalidated in the background once older than IMAGE_CATALOG_MAX_AGE_MINUTES while
+    the indexed copy is used.
+    """
+    catalog_url = catalog_url or IMAGE_URLS_URL
+    with closing(open_image_catalog()) as conn:
+        row = conn.execute("SELECT fetched_at FROM catalogs WHERE catalog = ?", (catalog_url,)).fetchone()
+    if row is None or not row[0]:
+        fetch_image_urls(catalog_url)
+    elif time.time() - row[0] > IMAGE_CATALOG_MAX_AGE_MINUTES * 60:
+        refresh_catalog_in_background(catalog_url)
+    return catalog_url
+
+
+def get_image_urls(catalog_url=None):
+    """
+    Returns an image catalog (IMAGE_URLS_URL by default) from the index, fetching it on
+    first use rather than at import time.
+    """
+    return indexed_image_urls(ensure_image_catalog(catalog_url))
+
+
+def choose_catalog_images(catalog, count=1):
+    """
+    Returns the next image ({"image_url", "topic"}) of an indexed catalog in its shuffled
+    order, skipping images known to be invalid, followed by up to count - 1 images with the
+    same topic that come after it in that order. Once the whole catalog was used it is
+    shuffled again. Returns an empty list if the catalog has no usable image.
+    """
+    with closing(open_image_catalog()) as conn:
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")  # Concurrent cycles never get the same image
+        try:
+            # fetched_at 0: the row only holds the cursor, the catalog itself was never fetched
+            conn.execute("INSERT OR IGNORE INTO catalogs (catalog, fetched_at) VALUES (?, 0)", (catalog,))
+            cursor = conn.execute("SELECT cursor FROM catalogs WHERE catalog = ?", (catalog,)).fetchone()[0]
+            row = None
+            for _ in range(2):
+                row = conn.execute(
+                    "SELECT image_url, topic, position FROM catalog_images "
+                    "WHERE catalog = ? AND position > ? AND valid IS NOT 0 ORDER BY position LIMIT 1",
+                    (catalog, cursor),
+                ).fetchone()
+                if row is not None or cursor < 0:
+                    break
+                # End of the shuffled order: start a new one
+                conn.execute(
+                    "UPDATE catalog_images SET position = random() / 18446744073709551616.0 + 0.5 WHERE catalog = ?",
+                    (catalog,),
+                )
+                cursor = -1
+            related = []
+            if row is not None:
+                conn.execute("UPDATE catalogs SET cursor = ? WHERE catalog = ?", (row[2], catalog))
+                if count > 1 and row[1]:
+                    related = conn.execute(
+                        "SELECT image_url, topic FROM catalog_images WHERE catalog = ? AND topic = ? "
+                        "AND position > ? AND valid IS NOT 0 ORDER BY position LIMIT ?",
+                        (catalog, row[1], row[2], count - 1),
+                    ).fetchall()
+                    # Move them behind the cursor (positions are at least 0, so minus 2 is below
+                    # any cursor) so they count as used until the next shuffle
+                    conn.executemany(
+                        "UPDATE catalog_images SET position = position - 2 WHERE catalog = ? AND image_url = ?",
+                        [(catalog, url) for url, _ in related],
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    if row is None:
+        return []
+    return [{"image_url": url, "topic": topic} for url, topic in [row[:2]] + related]
+
+
+def record_image_metadata(image_url, meta):
+    """
+    Stores what is known about an image (size, format, width, height, valid) in every
+    catalog that lists it, so invalid images are not picked (and downloaded) again.
+    """
+    valid = meta.get("valid")
+    try:
+        with closing(open_image_catalog()) as conn:
+            with conn:
+                conn.execute(
+                    "UPDATE catalog_images SET size = ?, format = ?, width = ?, height = ?, valid = ? "
+                    "WHERE image_url = ?",
+                    (meta.get("size"), meta.get("format"), meta.get("width"), meta.get("height"),
+                     None if valid is None else int(bool(valid)), image_url),
+                )
+    except sqlite3.Error as e:
+        print(f"Could not update image catalog {IMAGE_CATALOG_PATH}: {e}")
 
 # --- Configuration ---
 # Gemini API Key: Get this from Google AI Studio or Google Cloud Console.
@@ -59,6 +1017,12 @@ TWITTER_API_SECRET = os.getenv("TWITTER_API_SECRET", "YOUR_TWITTER_API_SECRET")
 TWITTER_ACCESS_TOKEN = os.getenv("TWITTER_ACCESS_TOKEN", "YOUR_TWITTER_ACCESS_TOKEN")
 TWITTER_ACCESS_TOKEN_SECRET = os.getenv("TWITTER_ACCESS_TOKEN_SECRET", "YOUR_TWITTER_ACCESS_TOKEN_SECRET")
 
+# API endpoints. They default to the real services; benchmark.py points them at local
+# stand-in servers so whole cycles can be measured offline.
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com/v19.0").rstrip("/")
+TWITTER_API_URL = os.getenv("TWITTER_API_URL", "https://api.x.com").rstrip("/")
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
 # Predefined topics for social media post generation
 TOPICS = [
     "Emphasize the importance of the user liking and following our facebook page https://www.facebook.com/profile.php?id=61578337620398. And following us on Twitter https://x.com/9Ecogreen"
@@ -107,114 +1071,429 @@ TOPICS = [
 ]
 
 
-# Initialize Gemini API
-# This checks if the API key is available before configuring the model.
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.0-flash') # Using the specified Gemini model
-else:
-    print("Warning: GEMINI_API_KEY not found in .env. AI content generation will not work.")
-    model = None
-    
+# Gemini API
+# google.generativeai (and grpc under it) takes a long time to import, so the model is
+# only created the first time content is actually generated.
+model = None
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """
+    Returns the Gemini model, importing and configuring google.generativeai on first use.
+    Returns None if GEMINI_API_KEY is not set. With TRAFFIC_MODE set, the model is wrapped
+    in a CassetteModel (which needs no key or SDK for replay).
+    """
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None and TRAFFIC_MODE == "replay":
+                model = CassetteModel()
+            elif model is None and GEMINI_API_KEY:
+                import google.generativeai as genai
+
+                if GEMINI_API_ENDPOINT:
+                    # A custom endpoint (e.g. a local stand-in) is only reachable over REST
+                    genai.configure(api_key=GEMINI_API_KEY, transport="rest",
+                                    client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+                else:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                model = genai.GenerativeModel('gemini-2.0-flash') # Using the specified Gemini model
+                if TRAFFIC_MODE == "record":
+                    model = CassetteModel(model)
+            elif model is None:
+                print("Warning: GEMINI_API_KEY not found in .env. AI content generation will not work.")
+    return model
+
 
 
-def download_image(url, filename):
+# --- Image Cache ---
+# Downloaded images are kept in IMAGE_CACHE_DIR, keyed by a hash of their URL.
+# Cached copies are revalidated with ETag/Last-Modified, written atomically so
+# concurrent runs never see a partial file, and the least recently used files
+# are evicted once the cache grows past IMAGE_CACHE_MAX_MB.
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", ".image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "200")) * 1024 * 1024
+# Larger originals are not downloaded; smaller ones are resized per platform (see IMAGE_PROFILES)
+MAX_SOURCE_IMAGE_BYTES = int(os.getenv("MAX_SOURCE_IMAGE_MB", "20")) * 1024 * 1024
+
+
+def image_cache_paths(url):
+    """
+    Returns the (image_path, metadata_path) pair used to cache the image at url.
+    The suffix is only a guess from the URL; the upload mime type comes from the format
+    detected when the image is inspected.
+    """
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    ext = os.path.splitext(urlsplit(url).path)[1].lower() or ".jpg"
+    base = os.path.join(IMAGE_CACHE_DIR, key)
+    return base + ext, base + ".json"
+
+
+def atomic_write(path, data, max_bytes=None):
     """
-    Downloads an image from a URL and saves it locally.
-    Returns the filename if successful, else None.
+    Writes bytes (or an iterable of byte chunks) to path through a temporary file in the
+    same directory and os.replace(), so readers see either the old or the new file, never
+    a partial one. Raises ValueError and leaves path untouched once more than max_bytes
+    have been written. Returns the number of bytes written.
     """
+    chunks = [data] if isinstance(data, (bytes, bytearray, memoryview)) else data
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    written = 0
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            with open(filename, 'wb') as f:
-                f.write(response.content)
-            return filename
-        else:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                written += len(chunk)
+                if max_bytes is not None and written > max_bytes:
+                    raise ValueError(f"more than {max_bytes/1024/1024:.2f} MB")
+                f.write(chunk)
+        os.replace(tmp_path, path)
+        return written
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def remove_cached_image(url):
+    image_path, meta_path = image_cache_paths(url)
+    for path in (image_path, meta_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def evict_image_cache(max_bytes=None):
+    """
+    Deletes least recently used cached images until the cache is within max_bytes.
+    Cache hits touch the file's mtime, so mtime order is LRU order.
+    """
+    max_bytes = IMAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    try:
+        for entry in os.scandir(IMAGE_CACHE_DIR):
+            if entry.is_file() and not entry.name.endswith(".json") and not entry.name.startswith(".tmp-"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        for stale_path in (path, os.path.splitext(path)[0] + ".json"):
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+        total -= size
+        print(f"Evicted cached image {os.path.basename(path)} ({size/1024:.0f} KB)")
+
+
+@traced("image_download")
+def download_image(url):
+    """
+    Returns a local path to the image at url, served from the image cache.
+    A cached copy is revalidated with If-None-Match/If-Modified-Since and only
+    downloaded again if it changed. If the host is unreachable, a cached copy is used as is.
+    The body is streamed to disk and the download is abandoned as soon as the
+    Content-Length or the running byte count exceeds MAX_SOURCE_IMAGE_BYTES.
+    Returns None if the image is neither cached nor downloadable.
+    """
+    image_path, meta_path = image_cache_paths(url)
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    meta = {}
+    if os.path.exists(image_path):
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+    headers = {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        with http_get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304 and meta:
+                print("Image not modified, using cached copy.")
+                count_metric("cache_hits", cache="image")
+                os.utime(image_path)
+                return image_path
+            if response.status_code == 200:
+                count_metric("cache_misses", cache="image")
+                content_length = int(response.headers.get("Content-Length") or 0)
+                if content_length > MAX_SOURCE_IMAGE_BYTES:
+                    print(f"Image too large: {content_length/1024/1024:.2f} MB. Skipping download.")
+                    record_image_metadata(url, {"size": content_length, "valid": False})
+                    return None
+                size = atomic_write(image_path, response.iter_content(64 * 1024), max_bytes=MAX_SOURCE_IMAGE_BYTES)
+                meta = {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "content_type": response.headers.get("Content-Type", "").split(";")[0].strip().lower() or None,
+                    "size": size,
+                }
+                atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+                evict_image_cache()
+                return image_path
             print(f"Failed to download image: {response.status_code}")
-            return None
+    except ValueError as e:
+        print(f"Image too large: {e}. Skipping download.")
+        record_image_metadata(url, {"valid": False})
+        return None
     except Exception as e:
         print(f"Error downloading image: {e}")
-        return None
+    if meta:
+        print("Using previously cached copy of the image.")
+        count_metric("cache_hits", cache="image_stale")
+        return image_path
+    return None
+
+class ImageBuffer:
+    """
+    Read-only, memory-mapped view of a cached image.
+    The same buffer is handed to the Facebook and Twitter uploads, so the image is
+    read from disk once and no temp files or extra in-process copies are made.
+    """
 
-def post_image_to_facebook_page(image_path, message):
-    url = f"https://graph.facebook.com/v19.0/{FACEBOOK_PAGE_ID}/photos"
+    def __init__(self, path, mime_type=None):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.mime_type = mime_type or mimetypes.guess_type(path)[0] or "image/jpeg"
+        if mime_type:
+            # The cached file's suffix comes from the URL, which may not name the format
+            self.filename = os.path.splitext(self.filename)[0] + (mimetypes.guess_extension(mime_type) or "")
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self._mmap)
+
+    def __len__(self):
+        return len(self.data)
+
+    def close(self):
+        # Safe to call more than once: platforms may share one buffer
+        self.data.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A slice is still referenced (e.g. by a traceback); the mapping is closed
+            # once it is garbage collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@traced("facebook_photo_post")
+def post_image_to_facebook_page(image, message, account=None):
+    account = account or default_account()
+    url = f"{GRAPH_API_URL}/{account.get('facebook_page_id')}/photos"
     payload = {
         "caption": message,
-        "access_token": FACEBOOK_ACCESS_TOKEN
+        "access_token": account.get("facebook_access_token")
     }
     files = {
-        "source": open(image_path, "rb")
+        "source": (image.filename, image.data, image.mime_type)
     }
-    response = requests.post(url, data=payload, files=files)
-    print("Facebook image response:", response.text)
-    return response.status_code == 200
-
-def post_image_to_twitter(image_path, message):
-    from requests_oauthlib import OAuth1
-    import mimetypes
-    # 1. Upload image
-    mime_type, _ = mimetypes.guess_type(image_path)
-    if not mime_type:
-        mime_type = "image/png"  # Default
-    with open(image_path, "rb") as image_file:
-        files = [
-            ('media', (os.path.basename(image_path), image_file, mime_type))
-        ]
-        payload = {
-            'media_type': mime_type,
-            'media_category': 'tweet_image'
-        }
-        response = requests.post(
-            "https://api.x.com/2/media/upload",
-            auth=OAuth1(
-                TWITTER_API_KEY,
-                TWITTER_API_SECRET,
-                TWITTER_ACCESS_TOKEN,
-                TWITTER_ACCESS_TOKEN_SECRET
-            ),
-            data=payload,
-            files=files
-        )
-    # Twitter returns both 'id' and 'media_key'. For posting, use 'id' (numeric string)
-    media_id = response.json().get("data", {}).get("id")
-    print("Twitter image upload response:", response.text)
-    # print("Media ID:", media_id)
-    # Check if media_id is present
-    # If not, log the error and return False
-    # This is important to ensure we don't proceed with an invalid media ID
-    # If media_id is None or empty, it means the upload failed
-    # and we should not attempt to post the tweet.
-    # This prevents errors when trying to post a tweet with an invalid media ID.
-    # If media_id is None or empty, it means the upload failed
-    # and we should not attempt to post the tweet.
-    # This prevents errors when trying to post a tweet with an invalid media ID.
-    
-    print("Media ID:", media_id)
-    if not media_id:
-        print("Twitter image upload failed:", response.text)
+    response = http_post(url, data=payload, files=files, rate_limit_keys=facebook_rate_limit_keys(account))
+    log_payload("Facebook image response:", response.text)
+    if response.status_code != 200:
         return False
-  
-    # Dynamically generate OAuth1 header using requests_oauthlib
-    from requests_oauthlib import OAuth1
-    print("message length", len(message))
-    url = "https://api.x.com/2/tweets"
+    # Return the post ID (recorded in the outbox); fall back to True if it is missing
+    try:
+        response_json = response.json()
+        return response_json.get("post_id") or response_json.get("id") or True
+    except ValueError:
+        return True
+
+# --- X Media Upload ---
+# Small images are sent in one multipart POST to /2/media/upload. Larger media, GIFs and
+# videos use the chunked flow: INITIALIZE, APPEND segments in parallel over the pooled
+# api.x.com connections (each segment is retried on its own), FINALIZE and, while X is
+# still processing the media, STATUS polling.
+TWITTER_MEDIA_UPLOAD_URL = f"{TWITTER_API_URL}/2/media/upload"
+TWITTER_CHUNKED_UPLOAD_THRESHOLD = int(os.getenv("TWITTER_CHUNKED_UPLOAD_THRESHOLD_KB", "1024")) * 1024
+TWITTER_UPLOAD_CHUNK_SIZE = int(os.getenv("TWITTER_UPLOAD_CHUNK_KB", "1024")) * 1024
+TWITTER_UPLOAD_WORKERS = int(os.getenv("TWITTER_UPLOAD_WORKERS", "4"))
+TWITTER_MEDIA_PROCESSING_TIMEOUT = float(os.getenv("TWITTER_MEDIA_PROCESSING_TIMEOUT", "300"))
+
+
+def twitter_media_category(mime_type):
+    if mime_type == "image/gif":
+        return "tweet_gif"
+    if mime_type.startswith("video/"):
+        return "tweet_video"
+    return "tweet_image"
+
+
+@traced("twitter_media_upload")
+def upload_media_to_twitter(media, account=None, media_category=None):
+    """
+    Uploads an ImageBuffer (image, GIF or video) to X and returns its media ID, or None on failure.
+    media_category defaults to tweet_image, tweet_gif or tweet_video based on the MIME type.
+    """
+    media_category = media_category or twitter_media_category(media.mime_type)
+    if media_category == "tweet_image" and len(media) <= TWITTER_CHUNKED_UPLOAD_THRESHOLD:
+        return upload_media_to_twitter_simple(media, account, media_category)
+    return upload_media_to_twitter_chunked(media, account, media_category)
+
+
+def upload_media_to_twitter_simple(media, account, media_category):
+    files = [
+        ('media', (media.filename, media.data, media.mime_type))
+    ]
+    payload = {
+        'media_type': media.mime_type,
+        'media_category': media_category
+    }
+    response = http_post(
+        TWITTER_MEDIA_UPLOAD_URL,
+        auth=twitter_auth(account),
+        data=payload,
+        files=files,
+        rate_limit_keys=twitter_rate_limit_keys("POST /2/media/upload", account),
+        priority=1
+    )
+    # Twitter returns both 'id' and 'media_key'. For posting, use 'id' (numeric string)
+    log_payload("Twitter image upload response:", response.text)
+    try:
+        return response.json().get("data", {}).get("id")
+    except ValueError:
+        return None
+
+
+def upload_media_to_twitter_chunked(media, account, media_category):
+    auth = twitter_auth(account)
+    total_bytes = len(media)
+    response = http_post(
+        f"{TWITTER_MEDIA_UPLOAD_URL}/initialize",
+        json={"media_type": media.mime_type, "total_bytes": total_bytes, "media_category": media_category},
+        auth=auth,
+        rate_limit_keys=twitter_rate_limit_keys("POST /2/media/upload/initialize", account),
+        priority=1,
+    )
+    media_id = response.json().get("data", {}).get("id") if response.ok else None
+    if not media_id:
+        print(f"Twitter media INIT failed. Status: {response.status_code}, Response: {response.text}")
+        return None
+
+    def append_segment(segment_index):
+        offset = segment_index * TWITTER_UPLOAD_CHUNK_SIZE
+        # A memoryview slice: the segment is not copied out of the media buffer. It is
+        # released right after the request, so a failed APPEND cannot keep the buffer open
+        with media.data[offset:offset + TWITTER_UPLOAD_CHUNK_SIZE] as segment:
+            segment_response = http_post(
+                f"{TWITTER_MEDIA_UPLOAD_URL}/{media_id}/append",
+                data={"segment_index": segment_index},
+                files={"media": ("segment", segment, "application/octet-stream")},
+                auth=auth,
+                retry=True,  # Re-sending a segment index is safe
+                rate_limit_keys=twitter_rate_limit_keys("POST /2/media/upload/append", account),
+                priority=1,
+            )
+        if not segment_response.ok:
+            raise requests.exceptions.HTTPError(
+                f"segment {segment_index} failed with {segment_response.status_code}: {segment_response.text}"
+            )
+
+    segment_count = -(-total_bytes // TWITTER_UPLOAD_CHUNK_SIZE)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(TWITTER_UPLOAD_WORKERS, segment_count))) as executor:
+            for future in [executor.submit(append_segment, index) for index in range(segment_count)]:
+                future.result()
+    except requests.exceptions.RequestException as e:
+        print(f"Twitter media APPEND failed: {e}")
+        return None
+    print(f"Uploaded {segment_count} segments ({total_bytes/1024:.0f} KB) in {time.perf_counter() - start:.2f}s")
+
+    response = http_post(
+        f"{TWITTER_MEDIA_UPLOAD_URL}/{media_id}/finalize",
+        auth=auth,
+        rate_limit_keys=twitter_rate_limit_keys("POST /2/media/upload/finalize", account),
+        priority=1,
+    )
+    if not response.ok:
+        print(f"Twitter media FINALIZE failed. Status: {response.status_code}, Response: {response.text}")
+        return None
+    processing_info = response.json().get("data", {}).get("processing_info")
+
+    deadline = time.monotonic() + TWITTER_MEDIA_PROCESSING_TIMEOUT
+    while processing_info and processing_info.get("state") in ("pending", "in_progress"):
+        if time.monotonic() > deadline:
+            print(f"Twitter media {media_id} still processing after {TWITTER_MEDIA_PROCESSING_TIMEOUT:.0f}s.")
+            return None
+        time.sleep(processing_info.get("check_after_secs") or 1)
+        response = http_get(
+            TWITTER_MEDIA_UPLOAD_URL,
+            params={"command": "STATUS", "media_id": media_id},
+            auth=auth,
+            rate_limit_keys=twitter_rate_limit_keys("GET /2/media/upload", account),
+            priority=1,
+        )
+        processing_info = response.json().get("data", {}).get("processing_info") if response.ok else None
+    if processing_info and processing_info.get("state") == "failed":
+        print(f"Twitter media processing failed: {processing_info.get('error')}")
+        return None
+    return media_id
+
+
+def post_image_to_twitter(image, message, account=None):
+    """
+    Uploads an image, GIF or video (see upload_media_to_twitter) and tweets it with the message.
+    Returns the tweet ID (True if the response had none) on success, False otherwise.
+    """
+    return post_images_to_twitter([image], message, account)
+
+
+@traced("twitter_image_post")
+def post_images_to_twitter(images, message, account=None):
+    """
+    Uploads up to 4 images (or one GIF or video) in parallel and tweets them with the message.
+    The tweet is only sent once every upload succeeded; media left over from a failed set
+    are never attached and X discards them after 24 hours.
+    Returns the tweet ID (True if the response had none) on success, False otherwise.
+    """
+    if len(images) > 1 and any(twitter_media_category(image.mime_type) != "tweet_image" for image in images):
+        print("X allows a single GIF or video per tweet. Posting the first media only.")
+        images = images[:1]
+    # 1. Upload media
+    outcomes = map_concurrently(lambda image: upload_media_to_twitter(image, account), images[:4])
+    media_ids = [media_id for media_id, _ in outcomes]
+    print("Media IDs:", media_ids)
+    # If any upload failed, the tweet is not sent: a partial carousel is never posted
+    if not all(media_ids):
+        errors = [str(error) for _, error in outcomes if error is not None]
+        print(f"Twitter image upload failed. {' '.join(errors)}".rstrip())
+        return False
+  
+    # The OAuth1 header is signed per request by twitter_auth()
+    print("message length", len(message))
+    url = f"{TWITTER_API_URL}/2/tweets"
     payload = {
         "text": message,
         "media": {
-            "media_ids": [str(media_id)]
+            "media_ids": [str(media_id) for media_id in media_ids]
         }
     }
     try:
-        oauth = OAuth1Session(
-            TWITTER_API_KEY,
-            client_secret=TWITTER_API_SECRET,
-            resource_owner_key=TWITTER_ACCESS_TOKEN,
-            resource_owner_secret=TWITTER_ACCESS_TOKEN_SECRET,
+        response = http_post(
+            url, json=payload, auth=twitter_auth(account),
+            rate_limit_keys=twitter_rate_limit_keys("POST /2/tweets", account)
         )
-        response = oauth.post(url, json=payload, timeout=10)
         print("Status code:", response.status_code)
-        print("Response:", response.text)
+        log_payload("Response:", response.text)
         if response.status_code == 201 or response.status_code == 200:
+            tweet_id = None
             try:
                 response_json = response.json()
                 tweet_id = response_json.get("data", {}).get("id")
@@ -224,7 +1503,7 @@ def post_image_to_twitter(image_path, message):
                     print(f"Successfully posted to Twitter! Response: {response_json}")
             except Exception:
                 print(f"Successfully posted to Twitter! Response: {response.text}")
-            return True
+            return tweet_id or True
         else:
             print(f"Twitter post failed. Status: {response.status_code}, Response: {response.text}")
             return False
@@ -234,91 +1513,672 @@ def post_image_to_twitter(image_path, message):
 
 
 
-def get_kenya_trends():
-    url = "https://trends24.in/kenya/"
+# --- Trends ---
+# Trends change hourly, so the scraped hashtags are cached on disk for TRENDS_TTL_SECONDS
+# and shared by every run on the host. An expired entry is still served right away while
+# a background thread revalidates it with a conditional request (stale-while-revalidate;
+# the thread is a daemon, so a short run does not wait for it at exit - the cache file is
+# replaced atomically), and it keeps being served, up to TRENDS_MAX_STALE_SECONDS old, if trends24.in is down.
+TRENDS_URL = os.getenv("TRENDS_URL", "https://trends24.in/kenya/")
+TRENDS_CACHE_PATH = os.getenv("TRENDS_CACHE_PATH", ".trends_cache.json")
+TRENDS_TTL_SECONDS = int(os.getenv("TRENDS_TTL_SECONDS", "3600"))
+TRENDS_MAX_STALE_SECONDS = int(os.getenv("TRENDS_MAX_STALE_SECONDS", "86400"))
+
+
+def read_trends_cache():
+    try:
+        with open(TRENDS_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def parse_kenya_trends(html):
+    """
+    Extracts the top trends from the trends24.in page. Only the trend list containers
+    are parsed into a tree (SoupStrainer), not the whole document.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    only_trend_lists = SoupStrainer("div", attrs={"class": "list-container"})
+    soup = BeautifulSoup(html, 'html.parser', parse_only=only_trend_lists)
+
+    # --- IMPORTANT: You need to inspect the trends24.in/kenya/ HTML to find the correct selectors ---
+    # Look for the HTML structure that contains the trending topics.
+    # This is a placeholder example based on common patterns:
+    trending_list_container = soup.find('div', class_='list-container') # Or whatever the actual class/id is
+
+    if trending_list_container:
+        trends = trending_list_container.find_all('li') # Assuming each trend is an <li> item
+
+        kenya_trends = []
+        for trend_item in trends:
+            hashtag_element = trend_item.find('a') # Assuming the hashtag is in an <a> tag
+
+            if hashtag_element:
+                hashtag = hashtag_element.get_text(strip=True)
+                kenya_trends.append(hashtag)
+                if len(kenya_trends) == 6:
+                    break
+        return kenya_trends  # Return top 6 trends
+    else:
+        print("Could not find the trending list container on the page.")
+        return []
+
+
+def refresh_kenya_trends(cache):
+    """
+    Fetches trends24.in with a conditional request based on the cached validators and
+    updates the cache file. Returns the fresh trends, or None if the fetch failed.
+    Only one process refreshes at a time; others return None and keep their cached value.
+    """
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
     } # Mimic a web browser
+    if cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
 
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+    with open(TRENDS_CACHE_PATH + ".lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print("Trends refresh already in progress in another run.")
+            return None
+        try:
+            response = http_get(TRENDS_URL, headers=headers)
+            if response.status_code == 304 and "trends" in cache:
+                trends = cache["trends"]
+            else:
+                response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+                trends = parse_kenya_trends(response.text)
+            cache = {
+                "trends": trends,
+                "fetched_at": time.time(),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            atomic_write(TRENDS_CACHE_PATH, json.dumps(cache).encode("utf-8"))
+            return trends
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching page: {e}")
+            return None
+        except Exception as e:
+            print(f"An error occurred during parsing: {e}")
+            return None
+
+
+@traced("trends")
+def get_kenya_trends():
+    """
+    Returns up to 6 trending hashtags in Kenya from the trends cache, refreshing it as needed.
+    """
+    cache = read_trends_cache()
+    age = time.time() - cache.get("fetched_at", 0)
+    if "trends" in cache and age < TRENDS_TTL_SECONDS:
+        count_metric("cache_hits", cache="trends")
+        return cache["trends"]
+    if "trends" in cache and age < TRENDS_MAX_STALE_SECONDS:
+        print(f"Trends cache is {age/60:.0f} minutes old. Serving it while refreshing in the background.")
+        count_metric("cache_hits", cache="trends_stale")
+        threading.Thread(target=refresh_kenya_trends, args=(cache,), name="trends-refresh", daemon=True).start()
+        return cache["trends"]
+    count_metric("cache_misses", cache="trends")
+    trends = refresh_kenya_trends(cache)
+    if trends is None:
+        return cache.get("trends", [])
+    return trends
 
-        soup = BeautifulSoup(response.text, 'html.parser')
+# --- Hashtag Packing ---
+# X counts a post by weighted length, not len(): every URL counts as 23 characters, emoji
+# (including ZWJ, skin-tone and flag sequences) and CJK/most non-Latin characters count
+# as 2, and Latin text, punctuation and common symbols count as 1. Trending hashtags are
+# packed into what is left of TWITTER_MAX_LENGTH with a 0/1 knapsack over the trends, scored
+# by trend rank. append_hashtags_to_messages() solves the knapsack once for a batch of
+# candidate messages and reads each message's best subset back in one pass over the trends.
+TWITTER_MAX_LENGTH = 278  # X allows 280; keep a small margin
+TWITTER_URL_LENGTH = 23
+TWITTER_URL_PATTERN = re.compile(
+    r"(?:https?://|www\.)[^\s]+?(?=[.,!?;:)\]'\"]*(?:\s|$))"
+    r"|\b[a-z0-9-]+(?:\.[a-z0-9-]+)*\.(?:com|net|org|info|io|co|ke|me|app|solutions)\b(?:/[^\s]*)?",
+    re.IGNORECASE,
+)
+# Code points X counts as 1: U+0000-U+10FF, U+2000-U+200D, U+2010-U+201F, U+2032-U+2037
+SINGLE_WEIGHT_RANGES = ((0x0000, 0x10FF), (0x2000, 0x200D), (0x2010, 0x201F), (0x2032, 0x2037))
+EMOJI_MODIFIERS = {0xFE0E, 0xFE0F, 0x20E3} | set(range(0x1F3FB, 0x1F400)) | set(range(0xE0020, 0xE0080))
 
-        # --- IMPORTANT: You need to inspect the trends24.in/kenya/ HTML to find the correct selectors ---
-        # Look for the HTML structure that contains the trending topics.
-        # This is a placeholder example based on common patterns:
-        trending_list_container = soup.find('div', class_='list-container') # Or whatever the actual class/id is
-        
-        if trending_list_container:
-            trends = trending_list_container.find_all('li') # Assuming each trend is an <li> item
-            
-            kenya_trends = []
-            for trend_item in trends:
-                hashtag_element = trend_item.find('a') # Assuming the hashtag is in an <a> tag
 
-                if hashtag_element:
-                    hashtag = hashtag_element.get_text(strip=True)
-                    kenya_trends.append(hashtag)
-            return kenya_trends[:6]  # Return top 4 trends
+def twitter_text_weight(text):
+    """
+    Weighted length of text without URLs. Code points that only extend an emoji (variation
+    selectors, skin tones, tags and everything joined with U+200D) add nothing, so a whole
+    emoji sequence counts 2, and a pair of regional indicators (a flag) counts 2.
+    """
+    if text.isascii():
+        return len(text)
+    weight = 0
+    base = None
+    joined = False
+    regional_open = False
+    for character in text:
+        code_point = ord(character)
+        if joined or (code_point in EMOJI_MODIFIERS and base is not None):
+            joined = False
+            if code_point == 0x20E3 and base <= 0x10FF:
+                weight += 1  # A keycap sequence counts 2 in total
+        elif code_point == 0x200D and base is not None and base > 0x10FF:
+            joined = True
+        elif 0x1F1E6 <= code_point <= 0x1F1FF and regional_open:
+            regional_open = False
         else:
-            print("Could not find the trending list container on the page.")
-            return []
+            regional_open = 0x1F1E6 <= code_point <= 0x1F1FF
+            if code_point <= 0x10FF or any(low <= code_point <= high for low, high in SINGLE_WEIGHT_RANGES):
+                weight += 1
+            else:
+                weight += 2
+            base = code_point
+    return weight
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching page: {e}")
-        return []
-    except Exception as e:
-        print(f"An error occurred during parsing: {e}")
+
+def twitter_weighted_length(text):
+    """
+    Returns the length X counts for text (see Hashtag Packing).
+    """
+    if not text.isascii():
+        text = unicodedata.normalize("NFC", text)
+    if "." not in text:
+        return twitter_text_weight(text)  # Every URL has a dot
+    weight = 0
+    position = 0
+    for match in TWITTER_URL_PATTERN.finditer(text):
+        weight += twitter_text_weight(text[position:match.start()]) + TWITTER_URL_LENGTH
+        position = match.end()
+    return weight + twitter_text_weight(text[position:])
+
+
+def truncate_to_twitter_length(text, limit=TWITTER_MAX_LENGTH):
+    """
+    Cuts text at the last whole word (or URL) that fits within limit weighted characters.
+    If not even the first word fits, the longest prefix of it that fits is kept, ending in "…".
+    """
+    kept = []
+    weight = 0
+    for token in re.split(r"(\s+)", text):
+        token_weight = twitter_weighted_length(token)
+        if weight + token_weight > limit:
+            break
+        kept.append(token)
+        weight += token_weight
+    truncated = "".join(kept).rstrip()
+    if truncated or not text.strip():
+        return truncated
+    text = text.lstrip()
+    for end in range(1, len(text)):
+        # Never cut inside an emoji sequence or before a combining mark
+        if text[end] in "\u200d\ufe0e\ufe0f" or text[end - 1] == "\u200d" or unicodedata.combining(text[end]):
+            continue
+        if twitter_weighted_length(text[:end] + "…") > limit:
+            break
+        truncated = text[:end] + "…"
+    return truncated
+
+
+def normalize_hashtags(hashtags):
+    """
+    Turns trends (a list ordered by rank, or a single string) into unique hashtags,
+    prefixing # and removing the spaces of multi-word trends.
+    """
+    if not hashtags:
         return []
+    if isinstance(hashtags, str):
+        hashtags = [hashtags]
+    normalized = []
+    seen = set()
+    for hashtag in hashtags:
+        hashtag = "".join(hashtag.split())
+        if not hashtag.strip("#"):
+            continue
+        hashtag = hashtag if hashtag.startswith("#") else f"#{hashtag}"
+        if hashtag.lower() not in seen:
+            seen.add(hashtag.lower())
+            normalized.append(hashtag)
+    return normalized
 
-def append_hashtags_to_message(message, hashtags):
+
+def append_hashtags_to_messages(messages, hashtags, limit=TWITTER_MAX_LENGTH):
     """
-    Appends a list of hashtags to the message, separated by spaces.
-    Ensures each hashtag starts with #. If the final message is longer than 278 characters,
-    removes hashtags without # one by one until the message is <= 278 chars.
+    Appends to each message the highest-scoring set of hashtags that keeps it within limit
+    weighted characters. A hashtag scores by its trend rank (the first of n scores n, the
+    last 1); the chosen ones are appended in rank order. Hashtags a message already
+    contains are not added again. A message that is too long on its own is cut at a word
+    boundary. Returns the final messages in the order given.
     """
-    hashtags_list = []
-    if hashtags:
-        if isinstance(hashtags, list):
-            hashtags_list = [(h if h.strip().startswith('#') else f'#{h.strip()}') for h in hashtags if h.strip()]
+    hashtags = normalize_hashtags(hashtags)
+    costs = [twitter_weighted_length(" " + hashtag) for hashtag in hashtags]
+    message_lengths = [twitter_weighted_length(message) for message in messages]
+    # Messages with room for every hashtag take them all; the knapsack only has to be
+    # solved up to the largest capacity that cannot
+    total_cost = sum(costs)
+    capacity = max([limit - length for length in message_lengths if limit - length < total_cost] + [0])
+
+    # best[c] is the best score within weight c; taken[i][c] records whether hashtag i is
+    # part of it, so the subset for any capacity can be read back from one table.
+    best = [0] * (capacity + 1)
+    taken = []
+    for index, cost in enumerate(costs):
+        score = len(hashtags) - index
+        took = bytearray(capacity + 1)
+        for c in range(capacity, cost - 1, -1):
+            if best[c - cost] + score > best[c]:
+                best[c] = best[c - cost] + score
+                took[c] = 1
+        taken.append(took)
+
+    results = []
+    for message, length in zip(messages, message_lengths):
+        if length > limit:
+            results.append(truncate_to_twitter_length(message, limit))
+            continue
+        c = limit - length
+        if c >= total_cost:
+            chosen = range(len(hashtags))
         else:
-            h = hashtags.strip()
-            hashtags_list = [h if h.startswith('#') else f'#{h}']
-    final_message = message + " " + " ".join(hashtags_list).strip()
-    # If too long, remove hashtags without # one by one
-    if len(final_message) > 278:
-        # Find indices of hashtags that originally did NOT have #
-        original_hashtags = hashtags if isinstance(hashtags, list) else [hashtags]
-        indices_to_remove = [i for i, h in enumerate(original_hashtags) if not h.strip().startswith('#')]
-        hashtags_copy = hashtags_list.copy()
-        for idx in indices_to_remove:
-            if idx < len(hashtags_copy):
-                hashtags_copy.pop(idx)
-                temp_message = message + " " + " ".join(hashtags_copy).strip()
-                if len(temp_message) <= 278:
-                    final_message = temp_message
-                    break
-        # If still too long, truncate hashtags until fits
-        while len(final_message) > 278 and hashtags_copy:
-            hashtags_copy.pop()
-            final_message = message + " " + " ".join(hashtags_copy).strip()
-    # Ensure final message is not longer than 278 characters
-    if len(final_message) > 278:
-        final_message = final_message[:278]
-    print("Final message length:", len(final_message))
+            chosen = []
+            for index in range(len(hashtags) - 1, -1, -1):
+                if taken[index][c]:
+                    chosen.append(index)
+                    c -= costs[index]
+            chosen.reverse()
+        lowered = message.lower()
+        tags = [hashtags[index] for index in chosen if hashtags[index].lower() not in lowered]
+        results.append(" ".join([message] + tags) if tags else message)
+    return results
+
+
+def append_hashtags_to_message(message, hashtags):
+    """
+    Appends the best-fitting trending hashtags to a tweet (see append_hashtags_to_messages),
+    keeping it within TWITTER_MAX_LENGTH as X counts it.
+    """
+    final_message = append_hashtags_to_messages([message], hashtags)[0]
+    print("Final message length:", twitter_weighted_length(final_message))
     return final_message
 
-def generate_twitter_ai_content(topic):
+
+def is_generated_content(text):
     """
-    Generates engaging social media post content for Twitter using the Gemini AI model.
-    The prompt is designed to create concise, engaging, and hashtag-rich tweets (max 180 characters).
+    False for the placeholder texts the generators return when Gemini is unavailable or failed.
+    """
+    return not text.startswith(("Failed to generate AI content", "AI model not configured"))
+
+
+def publishable_content(platform, text):
+    """
+    Returns text, or None for empty texts and generator placeholders, which are never posted.
+    """
+    if text and is_generated_content(text):
+        return text
+    print(f"No generated {platform} content ({text!r}). Skipping {platform}.")
+    count_metric("unpublishable_content", platform=platform)
+    return None
+
+
+# --- Gemini Response Cache ---
+# Generated texts are memoized in a local SQLite file, keyed on (platform, prompt template
+# hash, topic, time bucket), so a topic that comes up again within GEMINI_CACHE_BUCKET_MINUTES
+# reuses the earlier text instead of calling Gemini. One text is posted at most
+# GEMINI_CACHE_MAX_USES times. While run_accounts() posts for several accounts, a cached
+# text is shared between them but never handed to the same account twice (the miss is
+# counted with reason="used_by_account"); a single account reuses its own texts. Entries
+# expire after GEMINI_CACHE_TTL_HOURS, and the least recently used ones are evicted beyond
+# GEMINI_CACHE_MAX_ENTRIES. While Gemini is slow
+# (average latency above GEMINI_SLOW_SECONDS) or out of quota, or when a call fails, the
+# least used unexpired text for the topic from any bucket is served instead.
+GEMINI_CACHE_PATH = os.getenv("GEMINI_CACHE_PATH", "gemini_cache.db")
+GEMINI_CACHE_BUCKET_MINUTES = int(os.getenv("GEMINI_CACHE_BUCKET_MINUTES", "360"))
+GEMINI_CACHE_TTL_HOURS = float(os.getenv("GEMINI_CACHE_TTL_HOURS", "72"))
+GEMINI_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "1000"))
+GEMINI_CACHE_MAX_USES = int(os.getenv("GEMINI_CACHE_MAX_USES", "3"))
+GEMINI_SLOW_SECONDS = float(os.getenv("GEMINI_SLOW_SECONDS", "20"))
+GEMINI_QUOTA_COOLDOWN_SECONDS = 60
+
+gemini_cache_per_account = False  # set by run_accounts() for several accounts
+
+_gemini_health_lock = threading.Lock()
+gemini_health = {"latency_ewma": None, "quota_exhausted_until": 0.0, "latencies": []}
+
+
+def open_gemini_cache():
+    """
+    Opens the Gemini response cache database, creating the table on first use.
+    """
+    conn = sqlite3.connect(GEMINI_CACHE_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS gemini_cache ("
+        "key TEXT PRIMARY KEY, platform TEXT NOT NULL, template TEXT NOT NULL, topic TEXT NOT NULL, "
+        "bucket INTEGER NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL, "
+        "last_used_at REAL NOT NULL, uses INTEGER NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS gemini_cache_topic ON gemini_cache (platform, template, topic)")
+    conn.execute("CREATE INDEX IF NOT EXISTS gemini_cache_last_used ON gemini_cache (last_used_at)")
+    # The accounts each cached text was handed to
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS gemini_cache_accounts (key TEXT NOT NULL, account TEXT NOT NULL, "
+        "PRIMARY KEY (key, account))"
+    )
+    return conn
+
+
+def prompt_template_hash(template):
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+
+def gemini_cache_key(platform, template_hash, topic, bucket):
+    return hashlib.sha256(f"{platform}\0{template_hash}\0{topic}\0{bucket}".encode("utf-8")).hexdigest()
+
+
+def take_cached_generation(platform, template, topic, account_name, any_bucket=False):
+    """
+    Returns a cached text for the topic and counts one more use of it, or None.
+    Only the current time bucket is looked at unless any_bucket is set, in which case the
+    least used unexpired text of any bucket is taken. While gemini_cache_per_account is set,
+    texts the account was handed before are skipped.
+    """
+    template_hash = prompt_template_hash(template)
+    now = time.time()
+    bucket = int(now // (GEMINI_CACHE_BUCKET_MINUTES * 60))
+    per_account = gemini_cache_per_account
+    unused = " AND key NOT IN (SELECT key FROM gemini_cache_accounts WHERE account = ?)" if per_account else ""
+    if any_bucket:
+        candidates = "SELECT key FROM gemini_cache WHERE platform = ? AND template = ? AND topic = ? " \
+                     "AND created_at > ? AND uses < ?"
+        params = (platform, template_hash, topic, now - GEMINI_CACHE_TTL_HOURS * 3600, GEMINI_CACHE_MAX_USES)
+        where = f"key = ({candidates}{unused} ORDER BY uses, created_at DESC LIMIT 1)"
+    else:
+        candidates = "SELECT key FROM gemini_cache WHERE key = ? AND created_at > ? AND uses < ?"
+        params = (gemini_cache_key(platform, template_hash, topic, bucket), now - GEMINI_CACHE_TTL_HOURS * 3600,
+                  GEMINI_CACHE_MAX_USES)
+        where = f"key = ? AND created_at > ? AND uses < ?{unused}"
+    used_by_account = False
+    try:
+        with closing(open_gemini_cache()) as conn:
+            with conn:
+                row = conn.execute(
+                    f"UPDATE gemini_cache SET uses = uses + 1, last_used_at = ? WHERE {where} RETURNING text, key",
+                    (now,) + params + ((account_name,) if per_account else ()),
+                ).fetchone()
+                if row:
+                    conn.execute("INSERT OR IGNORE INTO gemini_cache_accounts VALUES (?, ?)", (row[1], account_name))
+                elif per_account:
+                    used_by_account = conn.execute(f"SELECT EXISTS ({candidates})", params).fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Could not read Gemini cache {GEMINI_CACHE_PATH}: {e}")
+        return None
+    cache = "gemini_stale" if any_bucket else "gemini"
+    if row:
+        count_metric("cache_hits", cache=cache)
+    elif used_by_account:
+        count_metric("cache_misses", cache=cache, reason="used_by_account")
+    else:
+        count_metric("cache_misses", cache=cache)
+    return row[0] if row else None
+
+
+def store_generation(platform, template, topic, text, account_name):
+    """
+    Caches a freshly generated text (counted as used once, by the account) in the current
+    time bucket, then drops expired entries and evicts the least recently used ones beyond
+    the limit.
+    """
+    template_hash = prompt_template_hash(template)
+    now = time.time()
+    bucket = int(now // (GEMINI_CACHE_BUCKET_MINUTES * 60))
+    key = gemini_cache_key(platform, template_hash, topic, bucket)
+    try:
+        with closing(open_gemini_cache()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO gemini_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)",
+                    (key, platform, template_hash, topic, bucket, text, now, now),
+                )
+                # A replaced entry is a new text: only this account has used it
+                conn.execute("DELETE FROM gemini_cache_accounts WHERE key = ?", (key,))
+                conn.execute("INSERT INTO gemini_cache_accounts VALUES (?, ?)", (key, account_name))
+                conn.execute(
+                    "DELETE FROM gemini_cache WHERE created_at <= ? OR uses >= ?",
+                    (now - GEMINI_CACHE_TTL_HOURS * 3600, GEMINI_CACHE_MAX_USES),
+                )
+                conn.execute(
+                    "DELETE FROM gemini_cache WHERE key IN "
+                    "(SELECT key FROM gemini_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                    (GEMINI_CACHE_MAX_ENTRIES,),
+                )
+                conn.execute(
+                    "DELETE FROM gemini_cache_accounts WHERE key NOT IN (SELECT key FROM gemini_cache)"
+                )
+    except sqlite3.Error as e:
+        print(f"Could not write Gemini cache {GEMINI_CACHE_PATH}: {e}")
+
+
+def gemini_degraded():
+    """
+    True while Gemini is out of quota or its average latency is above GEMINI_SLOW_SECONDS.
+    """
+    with _gemini_health_lock:
+        latency = gemini_health["latency_ewma"]
+        return time.time() < gemini_health["quota_exhausted_until"] or (
+            latency is not None and latency > GEMINI_SLOW_SECONDS
+        )
+
+
+def record_gemini_call(seconds, error=None):
+    """
+    Updates Gemini's latency average after a call, and starts a quota cooldown after a 429.
+    """
+    with _gemini_health_lock:
+        latency = gemini_health["latency_ewma"]
+        gemini_health["latency_ewma"] = seconds if latency is None else 0.7 * latency + 0.3 * seconds
+        if error is None:
+            latencies = gemini_health["latencies"]
+            latencies.append(seconds)
+            del latencies[:-GEMINI_LATENCY_SAMPLES]
+        elif "429" in str(error) or type(error).__name__ == "ResourceExhausted":
+            gemini_health["quota_exhausted_until"] = time.time() + GEMINI_QUOTA_COOLDOWN_SECONDS
+
+
+# --- Bounded Gemini Calls ---
+# Each Gemini call gets GEMINI_DEADLINE_SECONDS. The response is streamed so reading stops
+# as soon as the text reaches the platform's length limit (the rest would be cut anyway).
+# If the request has not finished by the p95 of recent call latencies, a second, hedged
+# request is started and whichever finishes first wins. When the deadline passes (or every
+# request failed), a cached text for the topic or a fixed fallback post is used right away.
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "30"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "true").lower() in ("1", "true", "yes")
+GEMINI_HEDGE_AFTER_SECONDS = float(os.getenv("GEMINI_HEDGE_AFTER_SECONDS", "10"))  # until p95 is known
+GEMINI_HEDGE_MIN_SECONDS = float(os.getenv("GEMINI_HEDGE_MIN_SECONDS", "1"))
+GEMINI_LATENCY_SAMPLES = 100
+GEMINI_MAX_CONCURRENT_CALLS = int(os.getenv("GEMINI_MAX_CONCURRENT_CALLS", "8"))
+GEMINI_LENGTH_LIMITS = {"twitter": 215, "facebook": 700}
+# Fixed copy: topics are instructions to the model, not text that can be posted
+FALLBACK_POSTS = {
+    "twitter": "🌿 Dreaming of a beautiful outdoor space? Ecogreen Contractors can make it happen! "
+               "Visit https://ecogreencontractors.solutions or WhatsApp +254746887291 for a quote.",
+    "facebook": "🌿 Looking for expert landscaping and outdoor services? Ecogreen Contractors "
+                "designs, builds and maintains beautiful outdoor spaces.\n\n👉 Visit "
+                "https://ecogreencontractors.solutions/ or chat with us on WhatsApp: +254746887291",
+}
+
+_gemini_executor = None
+_gemini_executor_lock = threading.Lock()
+
+
+def gemini_executor():
+    """
+    Thread pool the Gemini requests run on. Requests abandoned at the deadline finish in the
+    background (bounded by the request timeout) without holding up the post cycle.
+    """
+    global _gemini_executor
+    with _gemini_executor_lock:
+        if _gemini_executor is None:
+            _gemini_executor = ThreadPoolExecutor(
+                max_workers=GEMINI_MAX_CONCURRENT_CALLS, thread_name_prefix="gemini"
+            )
+        return _gemini_executor
+
+
+def gemini_hedge_delay():
+    """
+    Seconds to wait before hedging: the p95 of recent successful call latencies, or
+    GEMINI_HEDGE_AFTER_SECONDS until there are enough samples.
+    """
+    with _gemini_health_lock:
+        latencies = sorted(gemini_health["latencies"])
+    if len(latencies) < 20:
+        return GEMINI_HEDGE_AFTER_SECONDS
+    return max(GEMINI_HEDGE_MIN_SECONDS, latencies[int(0.95 * (len(latencies) - 1))])
+
+
+def cut_to_length(text, limit):
+    """
+    Shortens text to at most limit characters, at the last sentence end or line break in
+    the second half of the cut, otherwise at the last word.
+    """
+    if len(text) <= limit:
+        return text
+    cut = text[:limit + 1]
+    sentence_end = max(cut.rfind(mark) for mark in (". ", "! ", "? ", "\n"))
+    if sentence_end >= limit // 2:
+        return cut[:sentence_end + 1].rstrip()
+    return cut[:limit].rsplit(None, 1)[0].rstrip() if " " in cut[:limit] else cut[:limit]
+
+
+def stream_generation(model, prompt, limit, cancelled):
     """
+    Runs one streaming Gemini request and returns its text, reading no further once the
+    text reaches limit characters. Returns None if cancelled (another request won or the
+    deadline passed) before the text was complete.
+    """
+    start = time.perf_counter()
+    parts, length = [], 0
+    try:
+        response = model.generate_content(
+            prompt, stream=True, request_options={"timeout": GEMINI_DEADLINE_SECONDS}
+        )
+        for chunk in response:
+            if cancelled.is_set():
+                return None
+            try:
+                piece = chunk.text
+            except ValueError:
+                # Chunks without text parts (finish reason or safety ratings only)
+                continue
+            parts.append(piece)
+            length += len(piece)
+            if length >= limit:
+                count_metric("gemini_stream_cutoffs")
+                break
+    except Exception as e:
+        record_gemini_call(time.perf_counter() - start, e)
+        raise
+    record_gemini_call(time.perf_counter() - start)
+    return "".join(parts).strip()
+
+
+def generate_within_deadline(model, prompt, platform):
+    """
+    Returns the generated text for the prompt, cut to the platform's length limit, or None
+    if no request succeeded within GEMINI_DEADLINE_SECONDS.
+    """
+    limit = GEMINI_LENGTH_LIMITS[platform]
+    started = time.monotonic()
+    deadline = started + GEMINI_DEADLINE_SECONDS
+    hedge_at = started + gemini_hedge_delay() if GEMINI_HEDGE else None
+    cancelled = threading.Event()
+    pending = {gemini_executor().submit(stream_generation, model, prompt, limit, cancelled)}
+    try:
+        while pending:
+            wake_at = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, pending = wait(pending, timeout=max(0.0, wake_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    text = future.result()
+                except Exception as e:
+                    print(f"Gemini {platform} request failed: {e}")
+                    continue
+                if text is not None:
+                    return cut_to_length(text, limit)
+            now = time.monotonic()
+            if now >= deadline:
+                print(f"Gemini did not answer within {GEMINI_DEADLINE_SECONDS:g}s.")
+                count_metric("gemini_deadlines_exceeded", platform=platform)
+                return None
+            if hedge_at is not None and now >= hedge_at and pending:
+                print(f"Gemini {platform} request still running after {now - started:.1f}s. Sending a hedged request.")
+                count_metric("gemini_hedged_requests", platform=platform)
+                pending.add(gemini_executor().submit(stream_generation, model, prompt, limit, cancelled))
+                hedge_at = None
+        return None
+    finally:
+        cancelled.set()
+
+
+def fallback_generation(platform, template, topic, account_name):
+    """
+    Text used when Gemini produced nothing in time: the least used cached text for the
+    topic (that the account did not use yet), otherwise the platform's fixed fallback post
+    (which does not mention the topic).
+    """
+    text = take_cached_generation(platform, template, topic, account_name, any_bucket=True)
+    if text is not None:
+        print(f"Using cached {platform} content for topic: {topic}")
+        count_metric("gemini_fallbacks", platform=platform, source="cache")
+        return text
+    print(f"Using the fixed {platform} fallback post instead of content for topic: {topic}")
+    count_metric("gemini_fallbacks", platform=platform, source="fixed")
+    return FALLBACK_POSTS[platform]
+
+
+def generate_with_cache(platform, template, topic, avoid=None, account=None):
+    """
+    Returns a text for the prompt template (formatted with the topic) from the Gemini cache
+    or from Gemini (see generate_within_deadline), caching new texts. If Gemini gives nothing
+    in time, a cached or template text is returned instead (see fallback_generation).
+    Returns None if the model is not configured.
+    With avoid (an earlier text that must not be repeated), the cache and fallbacks are
+    skipped, Gemini is asked to word the post differently from it, and None is returned if
+    that fails. The account (the environment-configured one by default) is recorded as a
+    user of the text, see take_cached_generation().
+    """
+    account_name = (account or default_account())["name"]
+    if avoid is None:
+        text = take_cached_generation(platform, template, topic, account_name)
+        if text is not None:
+            print(f"Using cached {platform} content for topic: {topic}")
+            return text
+        if gemini_degraded():
+            text = take_cached_generation(platform, template, topic, account_name, any_bucket=True)
+            if text is not None:
+                print(f"Gemini is slow or out of quota. Reusing cached {platform} content for topic: {topic}")
+                return text
+    model = get_model()
     if not model:
-        return f"AI model not configured. Placeholder tweet for {topic}."
+        return None
 
-    prompt = f"""
+    prompt = template.format(topic=topic)
+    if avoid is not None:
+        prompt += f"\nWrite it differently from this earlier post, with new wording and a new angle:\n{avoid}\n"
+    text = generate_within_deadline(model, prompt, platform)
+    if text is None:
+        print(f"Error generating AI content for topic '{topic}'.")
+        return None if avoid is not None else fallback_generation(platform, template, topic, account_name)
+    log_payload(f"Gemini {platform} response:", text)
+    if text:
+        store_generation(platform, template, topic, text, account_name)
+    return text
+
+
+TWITTER_PROMPT_TEMPLATE = """
                 You are a creative social media marketing assistant for a landscaping and outdoor design company.
                 Your goal is to generate ONE concise, engaging, and lead-generating social media post for Twitter (max 215 characters).
                 The post should:
@@ -331,34 +2191,27 @@ def generate_twitter_ai_content(topic):
 
                 Topic: "{topic}"
                 """
-    try:
-        response = model.generate_content(prompt)
-        print("Twitter API Response:", response)
-        if response.candidates and response.candidates[0].content.parts:
-            single_tweet = response.candidates[0].content.parts[0].text.strip()
-            if not single_tweet:
-                single_tweet = "Contact us for expert landscaping and outdoor services!"
-            return single_tweet
-        else:
-            print(f"Error: Gemini API response structure unexpected or empty content for topic '{topic}'.")
-            return f"Failed to generate AI content for {topic}."
-    except Exception as e:
-        print(f"Error generating AI content for topic '{topic}': {e}")
+
+
+@traced("twitter_generation", ok=is_generated_content)
+def generate_twitter_ai_content(topic, avoid=None, account=None):
+    """
+    Generates engaging social media post content for Twitter using the Gemini AI model.
+    The prompt is designed to create concise, engaging, and hashtag-rich tweets (max 180 characters).
+    Recent texts for the same topic are reused from the Gemini cache (see generate_with_cache).
+    """
+    single_tweet = generate_with_cache("twitter", TWITTER_PROMPT_TEMPLATE, topic, avoid, account)
+    if single_tweet is None:
+        if not GEMINI_API_KEY:
+            return f"AI model not configured. Placeholder tweet for {topic}."
         return f"Failed to generate AI content for {topic}."
+    return single_tweet or "Contact us for expert landscaping and outdoor services!"
 
 
 
 # --- Helper Functions ---
 
-def generate_facebook_ai_content(topic):
-    """
-    Generates engaging social media post content using the Gemini AI model.
-    The prompt is designed to create lead-generating and engaging messages.
-    """
-    if not model:
-        return f"AI model not configured. Placeholder post for {topic}."
-
-    prompt = f"""
+FACEBOOK_PROMPT_TEMPLATE = """
         You are a creative social media marketing assistant for a landscaping and outdoor design company.
         Your goal is to generate ONE concise, engaging, and lead-generating social media post for Facebook (max 700 characters).
         The post should:
@@ -374,28 +2227,239 @@ def generate_facebook_ai_content(topic):
 
 Topic: "{topic}"
 """
+
+
+@traced("facebook_generation", ok=is_generated_content)
+def generate_facebook_ai_content(topic, avoid=None, account=None):
+    """
+    Generates engaging social media post content using the Gemini AI model.
+    The prompt is designed to create lead-generating and engaging messages.
+    Recent texts for the same topic are reused from the Gemini cache (see generate_with_cache).
+    """
+    single_post = generate_with_cache("facebook", FACEBOOK_PROMPT_TEMPLATE, topic, avoid, account)
+    if single_post is None:
+        if not GEMINI_API_KEY:
+            return f"AI model not configured. Placeholder post for {topic}."
+        return f"Failed to generate AI content for {topic}."
+    # Final fallback: ensure non-empty message
+    return single_post or "Contact us for expert landscaping and outdoor services! [visit our website](https://ecogreencontractors.solutions/) or [chat with us on whatsapp](https://wa.me/254746887291?text=Hello%21%20I%27m%20interested%20in%20landscaping%20and%20outdoor%20services)"
+
+# --- Graph API Batching ---
+# graph_batch() sends up to 50 Graph API operations in one HTTP request. While
+# run_accounts() posts for several pages, post_to_facebook() hands its /feed call to
+# a GraphBatcher, which sends the calls of concurrent cycles together once every
+# account worker has queued one (at most 50) or FACEBOOK_BATCH_LINGER_MS has passed.
+# Batched posts do not take a FACEBOOK_MAX_CONCURRENCY slot, since the whole batch is
+# one request. Each operation carries its own page access token, and every result is
+# mapped back to the cycle that submitted it. The batch request counts against the
+# app-wide rate limit; each operation waits for its page's bucket before it is queued,
+# and the usage headers of its result update that bucket.
+GRAPH_BATCH_LIMIT = 50
+FACEBOOK_BATCH = os.getenv("FACEBOOK_BATCH", "true").lower() in ("1", "true", "yes")
+FACEBOOK_BATCH_LINGER_MS = int(os.getenv("FACEBOOK_BATCH_LINGER_MS", "250"))
+
+
+class GraphBatchResponse:
+    """
+    The result of one operation in a Graph batch request. It has the parts of
+    requests.Response that the post functions and the rate limiter use (status_code,
+    text, headers, json()).
+    """
+
+    def __init__(self, status_code, text, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def graph_batch(operations, access_token):
+    """
+    Sends operations ({"method", "relative_url", "body"} dicts, with body as a form dict)
+    as Graph batch requests of up to 50 operations each. access_token is the batch's
+    fallback token; an operation can set its own in its body. The rate-limit buckets in an
+    operation's optional "rate_limit_keys" are updated from the headers of its result.
+    Returns one GraphBatchResponse per operation, in order.
+    """
+    results = []
+    for start in range(0, len(operations), GRAPH_BATCH_LIMIT):
+        chunk = operations[start:start + GRAPH_BATCH_LIMIT]
+        batch = []
+        for operation in chunk:
+            request = {"method": operation["method"], "relative_url": operation["relative_url"]}
+            if operation.get("body"):
+                request["body"] = urlencode(operation["body"])
+            batch.append(request)
+        response = http_post(
+            GRAPH_API_URL,
+            data={"batch": json.dumps(batch), "access_token": access_token, "include_headers": "true"},
+            rate_limit_keys=[("facebook-app",)],
+        )
+        if response.status_code != 200:
+            results += [GraphBatchResponse(response.status_code, response.text) for _ in chunk]
+            continue
+        print(f"Sent Graph batch request with {len(chunk)} operations.")
+        items = response.json()[:len(chunk)]
+        # Every operation gets a result (and its waiting cycle is released) even from a short response
+        items += [{"code": 502, "body": json.dumps({"error": {"message": "Missing batch result"}})}] * (
+            len(chunk) - len(items)
+        )
+        for operation, item in zip(chunk, items):
+            if item is None:
+                # Graph returns null for operations that did not complete in time
+                result = GraphBatchResponse(504, json.dumps({"error": {"message": "Batch operation timed out"}}))
+            else:
+                headers = {header.get("name"): header.get("value") for header in item.get("headers") or []}
+                result = GraphBatchResponse(item.get("code", 500), item.get("body") or "", headers)
+            if operation.get("rate_limit_keys"):
+                rate_limiter.observe(operation["rate_limit_keys"], result)
+            results.append(result)
+    return results
+
+
+class GraphBatcher:
+    """
+    Queues Graph API operations submitted from concurrent threads and sends them with
+    graph_batch() once size (at most GRAPH_BATCH_LIMIT) are queued or linger_seconds after
+    the first one.
+    """
+
+    def __init__(self, linger_seconds, size=GRAPH_BATCH_LIMIT):
+        self.linger_seconds = linger_seconds
+        self.size = max(1, min(size, GRAPH_BATCH_LIMIT))
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+    def submit(self, method, relative_url, body, rate_limit_keys=None):
+        """
+        Queues an operation and returns a Future that resolves to its GraphBatchResponse.
+        With rate_limit_keys, first waits for capacity in those buckets (raising
+        RateLimitExceeded if the wait would be too long).
+        """
+        if rate_limit_keys:
+            rate_limiter.acquire(rate_limit_keys)
+        operation = {"method": method, "relative_url": relative_url, "body": body, "rate_limit_keys": rate_limit_keys}
+        future = Future()
+        with self._lock:
+            self._pending.append((operation, future))
+            full = len(self._pending) >= self.size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.linger_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+        return future
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return
+        try:
+            results = graph_batch([operation for operation, _ in pending], pending[0][0]["body"]["access_token"])
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(pending, results):
+            future.set_result(result)
+
+
+facebook_batcher = None
+
+
+@traced("facebook_multi_photo_post")
+def post_images_to_facebook_page(images, message, account=None):
+    """
+    Publishes one Facebook post with several photos. The photos are uploaded in parallel
+    as unpublished photos, then attached to a single /feed post with attached_media.
+    The post is only made once every upload succeeded; otherwise (or if the post fails)
+    the uploaded photos are deleted again.
+    Returns the post ID, or False if an upload or the post failed.
+    """
+    account = account or default_account()
+    page_id = account.get("facebook_page_id")
+    access_token = account.get("facebook_access_token")
+
+    def upload_unpublished(image):
+        response = http_post(
+            f"{GRAPH_API_URL}/{page_id}/photos",
+            data={"published": "false", "access_token": access_token},
+            files={"source": (image.filename, image.data, image.mime_type)},
+            rate_limit_keys=facebook_rate_limit_keys(account),
+        )
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(f"photo upload failed with {response.status_code}: {response.text}")
+        return response.json()["id"]
+
+    outcomes = map_concurrently(upload_unpublished, images)
+    media_ids = [media_id for media_id, _ in outcomes if media_id]
+    errors = [error for _, error in outcomes if error is not None]
+    if errors:
+        print(f"Facebook multi-photo upload failed: {errors[0]}")
+        delete_facebook_photos(media_ids, account)
+        return False
+
     try:
-        # Make the API call to Gemini
-        response = model.generate_content(prompt)
-        print("API Response:", response)  # Debugging line to see the full response structure
-        # Extract the text from the API response
-        if response.candidates and response.candidates[0].content.parts:
-            single_post = response.candidates[0].content.parts[0].text.strip()
-            # Final fallback: ensure non-empty message
-            if not single_post:
-                single_post = "Contact us for expert landscaping and outdoor services! [visit our website](https://ecogreencontractors.solutions/) or [chat with us on whatsapp](https://wa.me/254746887291?text=Hello%21%20I%27m%20interested%20in%20landscaping%20and%20outdoor%20services)"
-            return single_post
+        response = http_post(
+            f"{GRAPH_API_URL}/{page_id}/feed",
+            data={
+                "message": message,
+                "attached_media": json.dumps([{"media_fbid": media_id} for media_id in media_ids]),
+                "access_token": access_token,
+            },
+            rate_limit_keys=facebook_rate_limit_keys(account),
+        )
+    except requests.exceptions.RequestException as e:
+        print(f"Facebook multi-photo post failed: {e}")
+        delete_facebook_photos(media_ids, account)
+        return False
+    log_payload("Facebook multi-photo response:", response.text)
+    if response.status_code != 200:
+        delete_facebook_photos(media_ids, account)
+        return False
+    try:
+        return response.json().get("id") or True
+    except ValueError:
+        return True
+
+
+def delete_facebook_photos(photo_ids, account):
+    """
+    Deletes (in parallel) the unpublished photos of a multi-photo post that was not made.
+    """
+    access_token = account.get("facebook_access_token")
+
+    def delete(photo_id):
+        response = http_request(
+            "DELETE", f"{GRAPH_API_URL}/{photo_id}", params={"access_token": access_token},
+            rate_limit_keys=facebook_rate_limit_keys(account),
+        )
+        if response.status_code != 200:
+            raise requests.exceptions.HTTPError(f"delete failed with {response.status_code}: {response.text}")
+
+    deleted = 0
+    for photo_id, (_, error) in zip(photo_ids, map_concurrently(delete, photo_ids)):
+        if error is not None:
+            print(f"Could not delete unpublished Facebook photo {photo_id}: {error}")
         else:
-            print(f"Error: Gemini API response structure unexpected or empty content for topic '{topic}'.")
-            return f"Failed to generate AI content for {topic}."
-    except Exception as e:
-        # Catch any exceptions during the API call or response parsing
-        print(f"Error generating AI content for topic '{topic}': {e}")
-        return f"Failed to generate AI content for {topic}."
+            deleted += 1
+    if deleted:
+        print(f"Deleted {deleted} unpublished Facebook photos.")
 
-def post_to_facebook(message):
+@traced("facebook_post")
+def post_to_facebook(message, account=None):
     """
     Posts a message to a Facebook Page using the Graph API.
+    Uses the account's page credentials, or the environment-configured ones by default.
+    Returns the new post ID on success, False otherwise.
     
     Requirements:
     - The FACEBOOK_ACCESS_TOKEN must be a Page Access Token (not a User Access Token).
@@ -411,25 +2475,34 @@ def post_to_facebook(message):
     6. Update your .env with this token.
     """
     print(f"Attempting to post to Facebook: {message[:70]}...")
+    account = account or default_account()
+    page_id = account.get("facebook_page_id")
+    access_token = account.get("facebook_access_token")
     # Validate credentials and token format
-    if not FACEBOOK_PAGE_ID or not FACEBOOK_ACCESS_TOKEN or FACEBOOK_ACCESS_TOKEN == "YOUR_FACEBOOK_ACCESS_TOKEN" or FACEBOOK_PAGE_ID == "YOUR_FACEBOOK_PAGE_ID":
+    if not page_id or not access_token or access_token == "YOUR_FACEBOOK_ACCESS_TOKEN" or page_id == "YOUR_FACEBOOK_PAGE_ID":
         print("Facebook API credentials not properly configured. Skipping Facebook post.")
         print("Make sure you have a valid Page Access Token with 'pages_read_engagement' and 'pages_manage_posts' permissions.")
         return False
  
-    url = f"https://graph.facebook.com/{FACEBOOK_PAGE_ID}/feed"
+    url = f"{GRAPH_API_URL}/{page_id}/feed"
     payload = {
         "message": message,
-        "access_token": FACEBOOK_ACCESS_TOKEN
+        "access_token": access_token
     }
     try:
-        response = requests.post(url, data=payload, timeout=10)
+        if facebook_batcher is not None:
+            # Sent together with other pages' posts in one Graph batch request; the page's
+            # own bucket is checked here, the app-wide one by the batch request
+            page_keys = [key for key in facebook_rate_limit_keys(account) if key[0] == "facebook-page"]
+            response = facebook_batcher.submit("POST", f"{page_id}/feed", payload, page_keys).result()
+        else:
+            response = http_post(url, data=payload, rate_limit_keys=facebook_rate_limit_keys(account))
         if response.status_code == 200:
             response_json = response.json()
             post_id = response_json.get("id")
             if post_id:
                 print(f"Successfully posted to Facebook! Post ID: {post_id}")
-                return True
+                return post_id
             else:
                 print(f"Facebook API response did not contain post ID: {response_json}")
                 return False
@@ -448,25 +2521,26 @@ def post_to_facebook(message):
         print(f"Error posting to Facebook: {e}")
         return False
 
-def post_to_twitter(message):
+@traced("twitter_post")
+def post_to_twitter(message, account=None):
     """
-    Posts a message to Twitter using the Twitter API v2 and OAuth1Session.
+    Posts a message to Twitter using the Twitter API v2 and the shared OAuth1 signer (see twitter_auth).
+    Uses the account's credentials, or the environment-configured ones by default.
+    Returns the tweet ID (True if the response had none) on success, False otherwise.
     """
     print(f"Attempting to post to Twitter (X): {message}")
     print("posting to twitter a message with length", len(message))
-    url = "https://api.twitter.com/2/tweets"
+    url = f"{TWITTER_API_URL}/2/tweets"
     payload = {"text": message}
     try:
-        oauth = OAuth1Session(
-            TWITTER_API_KEY,
-            client_secret=TWITTER_API_SECRET,
-            resource_owner_key=TWITTER_ACCESS_TOKEN,
-            resource_owner_secret=TWITTER_ACCESS_TOKEN_SECRET,
+        response = http_post(
+            url, json=payload, auth=twitter_auth(account),
+            rate_limit_keys=twitter_rate_limit_keys("POST /2/tweets", account)
         )
-        response = oauth.post(url, json=payload, timeout=10)
         print("Status code:", response.status_code)
-        print("Response:", response.text)
+        log_payload("Response:", response.text)
         if response.status_code == 201 or response.status_code == 200:
+            tweet_id = None
             try:
                 response_json = response.json()
                 tweet_id = response_json.get("data", {}).get("id")
@@ -476,7 +2550,7 @@ def post_to_twitter(message):
                     print(f"Successfully posted to Twitter! Response: {response_json}")
             except Exception:
                 print(f"Successfully posted to Twitter! Response: {response.text}")
-            return True
+            return tweet_id or True
         else:
             print(f"Twitter post failed. Status: {response.status_code}, Response: {response.text}")
             return False
@@ -484,98 +2558,1341 @@ def post_to_twitter(message):
         print(f"Error posting to Twitter: {e}")
         return False
 
-def send_social_media_post():
-    """
-    Main function to orchestrate the social media post generation and sending process.
-    This function is called by the scheduler.
+# --- Content Bank ---
+# `python main.py fill-bank` pre-generates Facebook/Twitter post pairs for every
+# entry in TOPICS and every image topic in the image catalogs and stores them in a local
+# SQLite file. send_social_media_post() takes a banked pair for its topic and only
+# calls Gemini live when the bank has nothing for that topic. A cycle that ends up not
+# using its content (image download fallback, image failed validation) puts it back.
+CONTENT_BANK_PATH = os.getenv("CONTENT_BANK_PATH", "content_bank.db")
+CONTENT_BANK_PER_TOPIC = int(os.getenv("CONTENT_BANK_PER_TOPIC", "5"))
+CONTENT_BANK_WORKERS = int(os.getenv("CONTENT_BANK_WORKERS", "4"))
+
+
+def open_content_bank():
     """
-    print(f"\n--- Starting new social media post cycle at {time.ctime()} ---")
-    
-    # 1. Randomly select a topic
-    selected_topic = random.choice(TOPICS)
-    print(f"Selected topic: {selected_topic}")
-
-    # 2. Fetch trending hashtags in Kenya
-    trending_hashtags = get_kenya_trends()
-    print(f"Trending hashtags in Kenya: {trending_hashtags}")
-
-    # 3. Randomly decide to post with image or not 
-    # If IMAGE_URLS is empty, use_image will be False
-    # ALSO choose randomly between true and false
-    # to decide whether to use an image or not
-    use_image = bool(IMAGE_URLS) and random.choice([True, False])
-    image_path = None
-    image_url = None
-    image_topic = None
-    if use_image:
-        image_dict = random.choice(IMAGE_URLS)
-        image_url = image_dict["image_url"]
-        image_topic = image_dict["topic"]
-        print(f"Selected image URL: {image_url}")
-        print(f"Image topic: {image_topic}")
-        image_path = download_image(image_url, "temp_image.jpg")
-    if use_image and image_path:
-        # --- Image Validation ---
-        valid_image = True
-        # 1. Check file size (must be < 4MB)
+    Opens the content bank database, creating the table on first use.
+    """
+    conn = sqlite3.connect(CONTENT_BANK_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS content_bank ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, "
+        "facebook TEXT NOT NULL, twitter TEXT NOT NULL, created_at REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS content_bank_topic ON content_bank (topic, id)")
+    return conn
+
+
+def take_banked_content(topic):
+    """
+    Removes and returns the oldest banked (id, facebook_post, twitter_post, created_at) entry
+    for a topic. Returns None if the bank is empty for that topic or cannot be read.
+    """
+    try:
+        with closing(open_content_bank()) as conn:
+            with conn:
+                row = conn.execute(
+                    "DELETE FROM content_bank WHERE id = "
+                    "(SELECT id FROM content_bank WHERE topic = ? ORDER BY id LIMIT 1) "
+                    "RETURNING id, facebook, twitter, created_at",
+                    (topic,),
+                ).fetchone()
+        count_metric("cache_hits" if row else "cache_misses", cache="content_bank")
+        return row
+    except sqlite3.Error as e:
+        print(f"Could not read content bank {CONTENT_BANK_PATH}: {e}")
+        return None
+
+
+def bank_unused_content(topic, banked_content, facebook_post=None, twitter_post=None):
+    """
+    Puts content a cycle took but did not post back into the bank: the banked entry in its
+    old place in line, or else a freshly generated pair (never the fixed fallback posts).
+    """
+    if banked_content:
+        row = (banked_content[0], topic) + tuple(banked_content[1:])
+    elif all(text and is_generated_content(text) and text not in FALLBACK_POSTS.values()
+             for text in (facebook_post, twitter_post)):
+        row = (None, topic, facebook_post, twitter_post, time.time())
+    else:
+        return
+    try:
+        with closing(open_content_bank()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO content_bank (id, topic, facebook, twitter, created_at) VALUES (?, ?, ?, ?, ?)",
+                    row,
+                )
+        print(f"Put unused content back into the content bank for topic: {topic}")
+    except sqlite3.Error as e:
+        print(f"Could not write content bank {CONTENT_BANK_PATH}: {e}")
+
+
+def generate_ai_content_batch(topic, count):
+    """
+    Generates `count` Facebook/Twitter post pairs for a topic with a single Gemini call.
+    Returns a list of (facebook_post, twitter_post) tuples; empty on failure.
+    """
+    model = get_model()
+    if not model:
+        return []
+
+    prompt = f"""
+        You are a creative social media marketing assistant for a landscaping and outdoor design company.
+        Generate {count} different post pairs about the topic below. Each pair has:
+        - "facebook": ONE concise, engaging, and lead-generating Facebook post (max 700 characters).
+          Use relevant emojis, format it with proper spacing and line breaks, include trending hashtags
+          and add a call to action to visit website https://ecogreencontractors.solutions/ and chat on whatsapp to number +254746887291.
+        - "twitter": ONE concise, engaging, and lead-generating tweet (max 215 characters).
+          Use relevant emojis, dont include hashtags, and add a call to action to visit website
+          https://ecogreencontractors.solutions and enquire on whatsapp +254746887291.
+        Every pair must use different wording and angle from the others.
+        Output only a JSON array of objects with the keys "facebook" and "twitter".
+
+        Topic: "{topic}"
+        """
+    try:
+        response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+        text = response.candidates[0].content.parts[0].text.strip()
+        if text.startswith("```"):
+            text = text.strip("`").removeprefix("json").strip()
+        items = json.loads(text)
+    except Exception as e:
+        print(f"Error generating banked AI content for topic '{topic}': {e}")
+        return []
+    pairs = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        facebook_post = str(item.get("facebook", "")).strip()
+        twitter_post = str(item.get("twitter", "")).strip()
+        if facebook_post and twitter_post and len(twitter_post) <= 215 and len(facebook_post) <= 700:
+            pairs.append((facebook_post, twitter_post))
+    return pairs[:count]
+
+
+def fill_content_bank(per_topic=None, workers=None):
+    """
+    Tops up the content bank so every text topic and image topic (of every account
+    in ACCOUNTS_FILE, if set) has `per_topic` entries.
+    Topics are generated in parallel, one multi-output Gemini request per topic.
+    Returns the number of pairs added.
+    """
+    per_topic = per_topic or CONTENT_BANK_PER_TOPIC
+    workers = workers or CONTENT_BANK_WORKERS
+    if not get_model():
+        print("GEMINI_API_KEY not configured. Cannot fill the content bank.")
+        return 0
+    accounts = load_accounts(ACCOUNTS_FILE) if ACCOUNTS_FILE else [default_account()]
+    topics = []
+    for account in accounts:
+        topics += account["topics"] + [image["topic"] for image in account_image_urls(account) if image.get("topic")]
+    topics = list(dict.fromkeys(topics))
+    with closing(open_content_bank()) as conn:
+        counts = dict(conn.execute("SELECT topic, COUNT(*) FROM content_bank GROUP BY topic").fetchall())
+    missing = {topic: per_topic - counts.get(topic, 0) for topic in topics if counts.get(topic, 0) < per_topic}
+    print(f"Filling content bank for {len(missing)} of {len(topics)} topics ({per_topic} per topic)...")
+
+    added = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(generate_ai_content_batch, topic, count): topic for topic, count in missing.items()}
+        with closing(open_content_bank()) as conn:
+            for future in as_completed(futures):
+                topic = futures[future]
+                pairs = future.result()
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO content_bank (topic, facebook, twitter, created_at) VALUES (?, ?, ?, ?)",
+                        [(topic, facebook_post, twitter_post, time.time()) for facebook_post, twitter_post in pairs],
+                    )
+                added += len(pairs)
+                print(f"Banked {len(pairs)} post pairs for topic: {topic}")
+    print(f"Content bank filled with {added} new post pairs.")
+    return added
+
+
+# --- Image Preprocessing ---
+# Each platform has its own upload limits. An image that does not fit a profile
+# is resized/recompressed to JPEG once, and the variant is cached next to the
+# source as <sha256>.<platform>.jpg. The Pillow verification result is stored in
+# the source's cache metadata, so it is also paid only once per image.
+IMAGE_PROFILES = {
+    # Facebook rejects photos over 4MB; 2048px is the largest size it displays
+    "facebook": {"max_bytes": 4 * 1024 * 1024, "max_dimension": 2048, "formats": ("JPEG", "PNG", "GIF", "TIFF", "WEBP")},
+    # X accepts images up to 5MB; larger dimensions are downscaled by X anyway
+    "twitter": {"max_bytes": 5 * 1024 * 1024, "max_dimension": 4096, "formats": ("JPEG", "PNG", "GIF", "WEBP")},
+}
+EXTENSION_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".gif": "GIF", ".tiff": "TIFF", ".webp": "WEBP"}
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "TIFF": "image/tiff", "WEBP": "image/webp"}
+
+
+@traced("image_validation", ok=lambda meta: meta["valid"])
+def inspect_image(url, image_path):
+    """
+    Returns the cache metadata of a downloaded image, extended with its sha256, format,
+    dimensions and whether it passed Pillow verification. The checks run only the first
+    time an image (or a changed version of it) is seen; later runs read them from the metadata.
+    """
+    _, meta_path = image_cache_paths(url)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {"url": url}
+    size = os.path.getsize(image_path)
+    if "valid" in meta and meta.get("size") == size:
+        count_metric("cache_hits", cache="image_validation")
+        record_image_metadata(url, meta)
+        return meta
+
+    with open(image_path, "rb") as f:
+        meta["sha256"] = hashlib.file_digest(f, "sha256").hexdigest()
+    meta["size"] = size
+    # Until Pillow has looked at the file, trust the server's Content-Type over the URL's suffix
+    content_type_formats = {mime_type: image_format for image_format, mime_type in FORMAT_MIME_TYPES.items()}
+    meta["format"] = content_type_formats.get(meta.get("content_type")) or EXTENSION_FORMATS.get(
+        os.path.splitext(image_path)[1].lower()
+    )
+    meta["width"] = meta["height"] = None
+    try:
+        from PIL import Image
+        with Image.open(image_path) as img:
+            meta["format"] = img.format
+            meta["width"], meta["height"] = img.size
+            img.verify()
+        print("Image verified with Pillow.")
+        meta["valid"] = True
+    except ImportError:
+        print("Pillow not installed, skipping image verification.")
+        meta["valid"] = meta["format"] is not None
+    except Exception as e:
+        print(f"Image verification failed: {e}. Skipping upload.")
+        meta["valid"] = False
+    atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+    record_image_metadata(url, meta)
+    return meta
+
+
+def image_fits_profile(meta, profile):
+    if meta["size"] > profile["max_bytes"] or meta["format"] not in profile["formats"]:
+        return False
+    if meta["width"] and max(meta["width"], meta["height"]) > profile["max_dimension"]:
+        return False
+    return True
+
+
+@traced("image_resize")
+def build_image_variant(image_path, meta, profile_name):
+    """
+    Returns the path of the cached JPEG variant of an image for a platform profile,
+    creating it with Pillow if it does not exist yet. Quality is lowered, then the
+    image is scaled down further, until the variant fits the profile's byte limit.
+    """
+    from PIL import Image, ImageOps
+
+    profile = IMAGE_PROFILES[profile_name]
+    variant_path = os.path.join(IMAGE_CACHE_DIR, f"{meta['sha256']}.{profile_name}.jpg")
+    if os.path.exists(variant_path):
+        os.utime(variant_path)
+        count_metric("cache_hits", cache="image_variant")
+        return variant_path
+
+    with Image.open(image_path) as source:
+        img = ImageOps.exif_transpose(source)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        max_dimension = profile["max_dimension"]
+        while True:
+            img.thumbnail((max_dimension, max_dimension))
+            for quality in (90, 80, 70, 60):
+                output = io.BytesIO()
+                img.save(output, "JPEG", quality=quality, optimize=True)
+                if output.tell() <= profile["max_bytes"]:
+                    atomic_write(variant_path, output.getbuffer())
+                    print(f"Created {profile_name} image variant: {img.size[0]}x{img.size[1]}, "
+                          f"{output.tell()/1024:.0f} KB (quality {quality})")
+                    return variant_path
+            max_dimension = int(max(img.size) * 0.75)
+
+
+def download_and_prepare_image(url):
+    """
+    Downloads (or reuses the cached copy of) an image and prepares it for every platform.
+    Returns a dict mapping platform name to an ImageBuffer, None if the download failed,
+    or False if the image is not a valid image (or could not be prepared).
+    Platforms whose limits the original fits share one buffer.
+    """
+    image_path = download_image(url)
+    if not image_path:
+        return None
+    meta = inspect_image(url, image_path)
+    if not meta["valid"]:
+        print("Image did not pass validation. Image upload skipped.")
+        remove_cached_image(url)
+        return False
+    images = {}
+    try:
+        source = None
+        for profile_name, profile in IMAGE_PROFILES.items():
+            if image_fits_profile(meta, profile):
+                # Uploaded with the detected format's mime type, not one guessed from the URL
+                source = source or ImageBuffer(image_path, FORMAT_MIME_TYPES.get(meta["format"]))
+                images[profile_name] = source
+            else:
+                images[profile_name] = ImageBuffer(build_image_variant(image_path, meta, profile_name))
+        return images
+    except ImportError:
+        print("Pillow not installed, cannot resize the image for upload. Image upload skipped.")
+    except (OSError, ValueError) as e:
+        print(f"Could not prepare image {image_path}: {e}")
+    close_images(images)
+    return False
+
+
+def download_and_prepare_images(urls):
+    """
+    Downloads and prepares several images in parallel (see download_and_prepare_image).
+    Returns the prepared images of the URLs that worked, in order. If none did, returns
+    False when at least one image was downloaded but rejected, and None otherwise.
+    """
+    prepared = []
+    rejected = False
+    for url, (images, error) in zip(urls, map_concurrently(download_and_prepare_image, urls)):
+        if error is not None:
+            print(f"Could not prepare image {url}: {error}")
+        elif images:
+            prepared.append(images)
+        elif images is False:
+            rejected = True
+    if prepared:
+        return prepared
+    return False if rejected else None
+
+
+def close_images(images):
+    # Never raises: a buffer that cannot be closed must not fail the cycle that used it
+    for image in set(images.values()):
         try:
-            file_size = os.path.getsize(image_path)
-            if file_size > 4 * 1024 * 1024:
-                print(f"Image too large for Facebook upload: {file_size/1024/1024:.2f} MB. Skipping upload.")
-                valid_image = False
+            image.close()
         except Exception as e:
-            print(f"Could not check image file size: {e}")
-            valid_image = False
-        # 2. Check file extension/type
-        allowed_exts = [".jpg", ".jpeg", ".png", ".gif", ".tiff", ".heif", ".webp"]
-        ext = os.path.splitext(image_path)[1].lower()
-        if ext not in allowed_exts:
-            print(f"Image file type {ext} not allowed for Facebook upload. Skipping upload.")
-            valid_image = False
-        # 3. Try to verify image with Pillow if installed
+            print(f"Could not close image buffer {image.path}: {e}")
+
+
+# --- Outbox ---
+# Each post cycle records its completed stages (topic, content, image, facebook,
+# twitter, done) in a local SQLite outbox, keyed by an idempotency key. If the pod
+# crashes and is restarted (cronjob.yaml uses restartPolicy: OnFailure), the next
+# run with the same key reuses the chosen topic and generated content and skips
+# the platforms that were already posted to, instead of starting over.
+# The key is "<account>:<cycle id>". The cycle id is taken from CYCLE_ID (cronjob.yaml
+# sets it to the Job name); without one, every cycle gets a new id, so a rerun always
+# posts again. A cycle is only marked done once no platform post failed, so a rerun with
+# the same id retries the platforms that are still unposted.
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "14"))
+CYCLE_ID = os.getenv("CYCLE_ID")
+
+_cycle_numbers = itertools.count(1)
+
+
+def cycle_key(account, cycle_id=None):
+    cycle_id = cycle_id or CYCLE_ID or f"{time.strftime('%Y-%m-%dT%H:%M:%S')}-{os.getpid()}-{next(_cycle_numbers)}"
+    return f"{account['name']}:{cycle_id}"
+
+
+def open_outbox():
+    conn = sqlite3.connect(OUTBOX_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS outbox ("
+        "cycle_key TEXT NOT NULL, stage TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL, "
+        "PRIMARY KEY (cycle_key, stage))"
+    )
+    return conn
+
+
+def load_cycle_state(key):
+    """
+    Returns {stage: value} for the stages already completed under an idempotency key.
+    """
+    try:
+        with closing(open_outbox()) as conn:
+            rows = conn.execute("SELECT stage, value FROM outbox WHERE cycle_key = ?", (key,)).fetchall()
+        return {stage: json.loads(value) for stage, value in rows}
+    except sqlite3.Error as e:
+        print(f"Could not read outbox {OUTBOX_PATH}: {e}")
+        return {}
+
+
+def record_cycle_stage(key, stage, value):
+    """
+    Records a completed stage and its result. Finished cycles also prune entries older
+    than OUTBOX_RETENTION_DAYS. Outbox errors are reported but never stop a post.
+    """
+    try:
+        with closing(open_outbox()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO outbox (cycle_key, stage, value, created_at) VALUES (?, ?, ?, ?)",
+                    (key, stage, json.dumps(value), time.time()),
+                )
+                if stage == "done":
+                    conn.execute(
+                        "DELETE FROM outbox WHERE created_at < ?",
+                        (time.time() - OUTBOX_RETENTION_DAYS * 86400,),
+                    )
+    except sqlite3.Error as e:
+        print(f"Could not record stage '{stage}' of {key} in outbox {OUTBOX_PATH}: {e}")
+
+
+# --- Near-Duplicate Index ---
+# Every published message is stored as a MinHash signature of its words (URLs, hashtags,
+# mentions, emoji and punctuation are ignored), per account and platform. A new text is a
+# near duplicate if its estimated Jaccard distance to a post from the last
+# DUPLICATE_WINDOW_DAYS days is at most DUPLICATE_MAX_DISTANCE. The 32 MinHash values are
+# split into 8 bands of 4 (locality-sensitive hashing), each stored as one indexed hash, so a
+# lookup only compares the posts sharing a band with the new text, however many are stored.
+# At distance 0.2 a near duplicate shares a band with a probability above 98%.
+# send_social_media_post() regenerates a near-duplicate text (up to
+# DUPLICATE_REGENERATE_ATTEMPTS times) before anything is uploaded or posted.
+DUPLICATE_INDEX_PATH = os.getenv("DUPLICATE_INDEX_PATH", "published_posts.db")
+DUPLICATE_WINDOW_DAYS = int(os.getenv("DUPLICATE_WINDOW_DAYS", "30"))
+DUPLICATE_MAX_DISTANCE = float(os.getenv("DUPLICATE_MAX_DISTANCE", "0.2"))
+DUPLICATE_REGENERATE_ATTEMPTS = int(os.getenv("DUPLICATE_REGENERATE_ATTEMPTS", "2"))
+MINHASH_BANDS = 8
+MINHASH_ROWS = 4
+MINHASH_SIZE = MINHASH_BANDS * MINHASH_ROWS
+_duplicate_index_local = threading.local()
+DUPLICATE_NOISE_PATTERN = re.compile(r"https?://\S+|www\.\S+|#\w+|@\w+")
+
+
+def minhash(text):
+    """
+    Returns the MinHash signature (MINHASH_SIZE values) of the set of words in text.
+    The MINHASH_SIZE hash functions are the 64-bit words of one SHAKE-128 digest per word.
+    """
+    words = set(re.findall(r"\w+", DUPLICATE_NOISE_PATTERN.sub(" ", text.lower()))) or {""}
+    hashes = [struct.unpack(f"<{MINHASH_SIZE}Q", hashlib.shake_128(word.encode("utf-8")).digest(8 * MINHASH_SIZE))
+              for word in words]
+    return [min(column) for column in zip(*hashes)]
+
+
+def minhash_bands(signature):
+    """
+    Returns one signed 64-bit hash per band of the signature.
+    """
+    bands = []
+    for band in range(MINHASH_BANDS):
+        values = signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+        digest = hashlib.blake2b(repr((band, values)).encode("ascii"), digest_size=8).digest()
+        bands.append(int.from_bytes(digest, "big", signed=True))
+    return bands
+
+
+def duplicate_index():
+    """
+    Returns this thread's connection to the near-duplicate index, creating the table on first use.
+    Lookups sit on the cycle's critical path, so connections (and their prepared statements)
+    are kept for the life of the thread rather than opened per call.
+    """
+    conn = getattr(_duplicate_index_local, "conn", None)
+    if conn is not None:
+        return conn
+    conn = sqlite3.connect(DUPLICATE_INDEX_PATH, timeout=30)
+    band_columns = ", ".join(f"band{band} INTEGER NOT NULL" for band in range(MINHASH_BANDS))
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS published_posts ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, signature BLOB NOT NULL, "
+        f"{band_columns}, posted_at REAL NOT NULL, post_id TEXT)"
+    )
+    for band in range(MINHASH_BANDS):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS published_posts_band{band} ON published_posts (band{band})")
+    conn.execute("CREATE INDEX IF NOT EXISTS published_posts_posted_at ON published_posts (posted_at)")
+    _duplicate_index_local.conn = conn
+    return conn
+
+
+def find_near_duplicate(account, platform, text):
+    """
+    Returns the estimated Jaccard distance to the closest post of the account on the
+    platform within DUPLICATE_WINDOW_DAYS, if it is at most DUPLICATE_MAX_DISTANCE, or None.
+    """
+    signature = minhash(text)
+    scope = f"{account['name']}:{platform}"
+    cutoff = time.time() - DUPLICATE_WINDOW_DAYS * 86400
+    try:
+        rows = duplicate_index().execute(
+            " UNION ".join(
+                f"SELECT signature FROM published_posts WHERE band{band} = ? AND scope = ? AND posted_at > ?"
+                for band in range(MINHASH_BANDS)
+            ),
+            [value for band_hash in minhash_bands(signature) for value in (band_hash, scope, cutoff)],
+        ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Could not read near-duplicate index {DUPLICATE_INDEX_PATH}: {e}")
+        return None
+    closest = None
+    for (stored,) in rows:
+        stored = struct.unpack(f"<{MINHASH_SIZE}Q", stored)
+        distance = 1 - sum(1 for x, y in zip(signature, stored) if x == y) / len(signature)
+        closest = distance if closest is None else min(closest, distance)
+    return closest if closest is not None and closest <= DUPLICATE_MAX_DISTANCE else None
+
+
+def record_published_post(account, platform, text, post_id=None):
+    """
+    Adds a published message to the near-duplicate index and drops posts older than the window.
+    """
+    signature = minhash(text)
+    band_columns = ", ".join(f"band{band}" for band in range(MINHASH_BANDS))
+    try:
+        with duplicate_index() as conn:
+            conn.execute(
+                f"INSERT INTO published_posts (scope, signature, {band_columns}, posted_at, post_id) "
+                f"VALUES (?, ?, {', '.join('?' * MINHASH_BANDS)}, ?, ?)",
+                [f"{account['name']}:{platform}", struct.pack(f"<{MINHASH_SIZE}Q", *signature),
+                 *minhash_bands(signature), time.time(), None if post_id is True else str(post_id)],
+            )
+            conn.execute(
+                "DELETE FROM published_posts WHERE posted_at < ?", (time.time() - DUPLICATE_WINDOW_DAYS * 86400,)
+            )
+    except sqlite3.Error as e:
+        print(f"Could not update near-duplicate index {DUPLICATE_INDEX_PATH}: {e}")
+
+
+def regenerate_if_duplicate(account, platform, text, topic):
+    """
+    Returns text, or a regenerated text if it is a near duplicate of a recent post.
+    Returns None if every regenerated text was a near duplicate too (or generation failed).
+    """
+    generate = generate_facebook_ai_content if platform == "facebook" else generate_twitter_ai_content
+    for attempt in range(DUPLICATE_REGENERATE_ATTEMPTS + 1):
+        distance = find_near_duplicate(account, platform, text)
+        if distance is None:
+            return text
+        count_metric("near_duplicates", platform=platform)
+        if attempt == DUPLICATE_REGENERATE_ATTEMPTS:
+            break
+        print(f"{platform} content is a near duplicate of a recent post (distance {distance:.2f}). Regenerating...")
+        text = generate(topic, avoid=text, account=account)
+        if not is_generated_content(text):
+            break
+    print(f"Could not generate {platform} content that differs from recent posts. Skipping {platform}.")
+    return None
+
+
+# --- Concurrent Cycle Execution ---
+# When POST_CONCURRENTLY is enabled (the default), the independent steps of a
+# cycle (trends scrape, both Gemini generations, image download) run in a
+# thread pool, and the Facebook and Twitter posts are then sent in parallel.
+# Set POST_CONCURRENTLY=false to run every step one after the other.
+POST_CONCURRENTLY = os.getenv("POST_CONCURRENTLY", "true").lower() in ("1", "true", "yes")
+CYCLE_MAX_WORKERS = int(os.getenv("CYCLE_MAX_WORKERS", "4"))
+
+
+def run_stages(stages, concurrent=None):
+    """
+    Runs a dict of named zero-argument callables and returns (results, timings, wall_time).
+    Each stage is isolated: an exception in one stage is logged and its result is None,
+    so one failing platform never hides the result of the other.
+    """
+    if concurrent is None:
+        concurrent = POST_CONCURRENTLY
+    results = {}
+    timings = {}
+
+    def timed(name, func):
+        start = time.perf_counter()
         try:
-            from PIL import Image
-            with Image.open(image_path) as img:
-                img.verify()
-            print("Image verified with Pillow.")
-        except ImportError:
-            print("Pillow not installed, skipping image verification.")
+            return func()
         except Exception as e:
-            print(f"Image verification failed: {e}. Skipping upload.")
-            valid_image = False
-        if not valid_image:
-            print("Image did not pass validation. Facebook upload skipped.")
+            print(f"Stage '{name}' failed: {e}")
+            return None
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    if concurrent and len(stages) > 1:
+        workers = max(1, min(CYCLE_MAX_WORKERS, len(stages)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Each stage runs in a copy of the caller's context, so its spans carry the cycle key
+            futures = {
+                name: executor.submit(contextvars.copy_context().run, timed, name, func)
+                for name, func in stages.items()
+            }
+            for name, future in futures.items():
+                results[name] = future.result()
+    else:
+        for name, func in stages.items():
+            results[name] = timed(name, func)
+    return results, timings, time.perf_counter() - wall_start
+
+
+def map_concurrently(func, items):
+    """
+    Calls func on every item in its own thread (in a copy of the caller's context) and
+    returns a list of (result, exception) pairs in item order. A single item is run inline.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        outcomes = []
+        for item in items:
+            try:
+                outcomes.append((func(item), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+    return [(None, future.exception()) if future.exception() else (future.result(), None) for future in futures]
+
+
+def report_cycle_timings(timings, wall_time):
+    """
+    Prints per-stage timings and the wall-clock time saved compared to running
+    the same stages one after the other.
+    """
+    sequential_time = sum(timings.values())
+    for name, duration in timings.items():
+        print(f"  {name}: {duration:.2f}s")
+    print(
+        f"Cycle stages took {wall_time:.2f}s wall-clock "
+        f"(sequential estimate {sequential_time:.2f}s, saved {max(0.0, sequential_time - wall_time):.2f}s)"
+    )
+    return max(0.0, sequential_time - wall_time)
+
+
+def send_social_media_post(account=None, cycle_id=None):
+    """
+    Main function to orchestrate the social media post generation and sending process.
+    This function is called by the scheduler.
+
+    The trends scrape, both AI generations and the image download run together,
+    then both platforms are posted to together (see POST_CONCURRENTLY).
+    Posts for the given account profile (see load_accounts), or the environment-configured one.
+    Every completed stage is recorded in the outbox under the cycle's idempotency key
+    (see cycle_key), so a restarted run resumes where the previous attempt stopped.
+    The cycle and its stages are recorded as spans tagged with that key (see Metrics).
+    Returns a dict with each platform's success flag and the per-stage timings.
+    """
+    account = account or default_account()
+    key = cycle_key(account, cycle_id)
+    token = current_cycle.set(key)
+    try:
+        with span("cycle", account=account["name"]) as span_state:
+            result = run_post_cycle(account, key)
+            span_state["ok"] = bool(result["facebook"] and result["twitter"])
+        return result
+    finally:
+        current_cycle.reset(token)
+        write_metrics_textfile()
+
+
+def run_post_cycle(account, key):
+    state = load_cycle_state(key)
+    if "done" in state:
+        print(f"Post cycle {key} already completed. Nothing to do.")
+        return dict(state["done"], resumed=True)
+    print(f"\n--- Starting new social media post cycle {key} at {time.ctime()} ---")
+    if state:
+        print(f"Resuming post cycle after completed stages: {', '.join(state)}")
+
+    # 1. Randomly select a topic (or reuse the one chosen before a restart)
+    if "topic" in state:
+        chosen = state["topic"]
+    else:
+        selected_topic = random.choice(account["topics"])
+
+        # 2. Randomly decide to post with image or not 
+        # If the catalog has no usable image, no image is used
+        # ALSO choose randomly between true and false
+        # to decide whether to use an image or not
+        # Related images with the same topic turn the post into a carousel
+        image_dicts = choose_images(account) if random.choice([True, False]) else []
+        chosen = {"topic": selected_topic, "image_url": None, "image_topic": None, "image_urls": []}
+        if image_dicts:
+            chosen["image_url"] = image_dicts[0]["image_url"]
+            chosen["image_topic"] = image_dicts[0]["topic"]
+            chosen["image_urls"] = [image_dict["image_url"] for image_dict in image_dicts]
+        record_cycle_stage(key, "topic", chosen)
+    image_url = chosen["image_url"]
+    image_urls = chosen.get("image_urls") or ([image_url] if image_url else [])
+    use_image = image_url is not None
+    print(f"Selected topic: {chosen['topic']}")
+    if use_image:
+        print(f"Selected image URL{'s' if len(image_urls) > 1 else ''}: {', '.join(image_urls)}")
+        print(f"Image topic: {chosen['image_topic']}")
+    content_topic = chosen["image_topic"] if use_image else chosen["topic"]
+
+    # 3. Fetch trends, generate content and download the image (independent steps).
+    # Content comes from the outbox on resume, then from the content bank, then from Gemini.
+    prepare_stages = {}
+    banked_content = None
+    if "content" not in state:
+        banked_content = take_banked_content(content_topic)
+        prepare_stages["trends"] = get_kenya_trends
+        if banked_content:
+            print(f"Using banked content for topic: {content_topic}")
+        else:
+            prepare_stages["facebook_content"] = lambda: generate_facebook_ai_content(content_topic, account=account)
+            prepare_stages["twitter_content"] = lambda: generate_twitter_ai_content(content_topic, account=account)
+    if use_image and not {"facebook", "twitter"} <= set(state):
+        prepare_stages["image"] = lambda: download_and_prepare_images(image_urls)
+    prepared, timings, prepare_wall = run_stages(prepare_stages)
+
+    images = prepared.get("image")
+    if "image" in prepare_stages and images is None:
+        # As in the original script, an image that cannot be downloaded falls back to a
+        # text post about the selected topic (an image that fails validation skips the cycle)
+        print("Image download failed. Posting text only for the selected topic.")
+        chosen = dict(chosen, image_url=None, image_topic=None, image_urls=[])
+        record_cycle_stage(key, "topic", chosen)
+        use_image = False
+        if "content" not in state:
+            bank_unused_content(
+                content_topic, banked_content, prepared.get("facebook_content"), prepared.get("twitter_content")
+            )
+            content_topic = chosen["topic"]
+            banked_content = take_banked_content(content_topic)
+            if not banked_content:
+                text_content, text_timings, text_wall = run_stages({
+                    "facebook_text_content": lambda: generate_facebook_ai_content(content_topic, account=account),
+                    "twitter_text_content": lambda: generate_twitter_ai_content(content_topic, account=account),
+                })
+                prepared["facebook_content"] = text_content["facebook_text_content"]
+                prepared["twitter_content"] = text_content["twitter_text_content"]
+                timings.update(text_timings)
+                prepare_wall += text_wall
+
+    # Original behaviour: a selected image that fails validation skips the cycle
+    skip_cycle = use_image and images is False
+    if skip_cycle:
+        content = {"facebook": None, "twitter": None}
+        if "content" not in state:
+            bank_unused_content(
+                content_topic, banked_content, prepared.get("facebook_content"), prepared.get("twitter_content")
+            )
+    elif "content" in state:
+        content = state["content"]
+    else:
+        trending_hashtags = prepared["trends"] or []
+        print(f"Trending hashtags in Kenya: {trending_hashtags}")
+        if banked_content:
+            _, fb_post_content, x_post_content, _ = banked_content
+        else:
+            fb_post_content, x_post_content = prepared["facebook_content"], prepared["twitter_content"]
+        # Placeholders are never posted; near duplicates of recent posts are regenerated
+        fb_post_content = publishable_content("facebook", fb_post_content)
+        x_post_content = publishable_content("twitter", x_post_content)
+        if fb_post_content:
+            fb_post_content = regenerate_if_duplicate(account, "facebook", fb_post_content, content_topic)
+        if x_post_content:
+            x_post_content = regenerate_if_duplicate(account, "twitter", x_post_content, content_topic)
+        content = {
+            "facebook": fb_post_content,
+            "twitter": append_hashtags_to_message(x_post_content, trending_hashtags) if x_post_content else None,
+        }
+        record_cycle_stage(key, "content", content)
+    fb_post_content = content["facebook"]
+    x_post_content_with_hashtags = content["twitter"]
+    print(f"Twitter post content: {x_post_content_with_hashtags}")
+    if images:
+        record_cycle_stage(key, "image", {"image_url": image_url, "image_urls": image_urls})
+
+    def post_and_record(platform, post_function, *args):
+        if post_function is post_to_facebook and facebook_batcher is not None:
+            # Holding a slot while waiting for the batch would cap it at FACEBOOK_MAX_CONCURRENCY posts
+            post_id = post_function(*args)
+        else:
+            post_id = with_platform_slot(platform, post_function, *args)
+        if post_id:
+            record_cycle_stage(key, platform, post_id)
+            record_published_post(account, platform, content[platform], post_id)
+        return post_id
+
+    # 4. Post to both platforms (skipping any already posted before a restart)
+    result = {"account": account["name"], "facebook": False, "twitter": False, "timings": timings}
+    post_wall = 0.0
+    posted = {}
+    if skip_cycle:
+        print("Image did not pass validation. Nothing posted this cycle.")
+    else:
+        if images and len(images) > 1:
+            print(f"Posting a carousel of {len(images)} images.")
+            post_stages = {
+                "facebook_post": lambda: post_and_record(
+                    "facebook", post_images_to_facebook_page, [image["facebook"] for image in images],
+                    fb_post_content, account
+                ),
+                "twitter_post": lambda: post_and_record(
+                    "twitter", post_images_to_twitter, [image["twitter"] for image in images],
+                    x_post_content_with_hashtags, account
+                ),
+            }
+        elif images:
+            post_stages = {
+                "facebook_post": lambda: post_and_record(
+                    "facebook", post_image_to_facebook_page, images[0]["facebook"], fb_post_content, account
+                ),
+                "twitter_post": lambda: post_and_record(
+                    "twitter", post_image_to_twitter, images[0]["twitter"], x_post_content_with_hashtags, account
+                ),
+            }
         else:
-            # Generate AI marketing message for image using the image's topic
-            fb_post_content = generate_facebook_ai_content(image_topic)
-            x_post_content = generate_twitter_ai_content(image_topic)
-            x_post_content_with_hashtags = append_hashtags_to_message(x_post_content, trending_hashtags)
-            # Facebook
-            facebook_success = post_image_to_facebook_page(image_path, fb_post_content)
-            print(f"Facebook image post success: {facebook_success}")
-            print("\nPosting to Twitter with image...")
-            print(f"Twitter post content: {x_post_content_with_hashtags}")
-            # Twitter
-            twitter_success = post_image_to_twitter(image_path, x_post_content_with_hashtags)
-            print(f"Twitter image post success: {twitter_success}")
-        # Clean up temp image
+            post_stages = {
+                "facebook_post": lambda: post_and_record("facebook", post_to_facebook, fb_post_content, account),
+                "twitter_post": lambda: post_and_record("twitter", post_to_twitter, x_post_content_with_hashtags, account),
+            }
+        for platform in ("facebook", "twitter"):
+            if platform in state:
+                print(f"Already posted to {platform} before restart (ID: {state[platform]}). Skipping.")
+                result[platform] = True
+                post_stages.pop(f"{platform}_post")
+            elif not content[platform] or not is_generated_content(content[platform]):
+                print(f"No publishable {platform} content. Skipping {platform}.")
+                post_stages.pop(f"{platform}_post")
         try:
-            os.remove(image_path)
-        except Exception:
-            pass
+            posted, post_timings, post_wall = run_stages(post_stages)
+        finally:
+            for image in images or []:
+                close_images(image)
+        timings.update(post_timings)
+        for platform in ("facebook", "twitter"):
+            if f"{platform}_post" in posted:
+                result[platform] = bool(posted[f"{platform}_post"])
+        print(f"Facebook {'image ' if use_image else ''}post success: {result['facebook']}")
+        print(f"Twitter {'image ' if use_image else ''}post success: {result['twitter']}")
+
+    result["wall_seconds"] = prepare_wall + post_wall
+    result["saved_seconds"] = report_cycle_timings(timings, result["wall_seconds"])
+    # A failed platform post leaves the cycle open, so a rerun with the same cycle id retries it
+    unposted = [platform for platform in ("facebook", "twitter") if f"{platform}_post" in posted and not result[platform]]
+    if unposted:
+        print(f"Post cycle {key} not marked done: {' and '.join(unposted)} can be retried with the same cycle id.")
     else:
-        # Generate AI content for Facebook (no image)
-        post_content = generate_facebook_ai_content(selected_topic)
-        facebook_success = post_to_facebook(post_content)
-        print(f"Facebook post success: {facebook_success}")
-        # Generate AI content for Twitter and append hashtags
-        twitter_post_content = generate_twitter_ai_content(selected_topic)
-        twitter_post_content_with_hashtags = append_hashtags_to_message(twitter_post_content, trending_hashtags)
-        print(f"Twitter post content: {twitter_post_content_with_hashtags}")
-        twitter_success = post_to_twitter(twitter_post_content_with_hashtags)
-        print(f"Twitter post success: {twitter_success}")
+        record_cycle_stage(key, "done", {name: value for name, value in result.items() if name != "timings"})
     print("--- End of post cycle ---")
+    return result
+
+# --- Multi-Account Engine ---
+# ACCOUNTS_FILE (or `python main.py post --accounts FILE`) points to a JSON list of
+# account profiles, so one process posts for every brand instead of one CronJob each.
+# Accounts run in a pool of ACCOUNT_WORKERS threads and share HTTP connections and
+# caches; FACEBOOK_MAX_CONCURRENCY/TWITTER_MAX_CONCURRENCY cap the posts in flight per platform.
+ACCOUNTS_FILE = os.getenv("ACCOUNTS_FILE")
+ACCOUNT_WORKERS = int(os.getenv("ACCOUNT_WORKERS", "4"))
+PLATFORM_CONCURRENCY = {
+    "facebook": int(os.getenv("FACEBOOK_MAX_CONCURRENCY", "4")),
+    "twitter": int(os.getenv("TWITTER_MAX_CONCURRENCY", "2")),
+}
+_platform_slots = {platform: threading.BoundedSemaphore(limit) for platform, limit in PLATFORM_CONCURRENCY.items()}
+ACCOUNT_KEYS = (
+    "name", "facebook_page_id", "facebook_access_token",
+    "twitter_api_key", "twitter_api_secret", "twitter_access_token", "twitter_access_token_secret",
+    "topics", "image_urls_url", "image_urls",
+)
+
+
+def default_account():
+    """
+    Returns the account profile configured through environment variables (the single-brand setup).
+    """
+    return {
+        "name": "default",
+        "facebook_page_id": FACEBOOK_PAGE_ID,
+        "facebook_access_token": FACEBOOK_ACCESS_TOKEN,
+        "twitter_api_key": TWITTER_API_KEY,
+        "twitter_api_secret": TWITTER_API_SECRET,
+        "twitter_access_token": TWITTER_ACCESS_TOKEN,
+        "twitter_access_token_secret": TWITTER_ACCESS_TOKEN_SECRET,
+        "topics": TOPICS,
+        "image_urls_url": IMAGE_URLS_URL,
+    }
+
+
+def account_image_urls(account):
+    """
+    Returns an account's image catalog: its inline "image_urls" list, or the catalog at its "image_urls_url".
+    """
+    if "image_urls" in account:
+        return account["image_urls"]
+    return get_image_urls(account.get("image_urls_url"))
+
+
+def choose_images(account, count=CAROUSEL_MAX_IMAGES):
+    """
+    Picks the account's next image from the catalog index, plus up to count - 1 related
+    images with the same topic for a carousel (see choose_catalog_images).
+    An inline "image_urls" list is indexed as its own catalog, "account:<name>".
+    Returns a list of images, empty if the account has no usable image.
+    """
+    if "image_urls" in account:
+        catalog = f"account:{account['name']}"
+        with closing(open_image_catalog()) as conn:
+            with conn:
+                sync_catalog(conn, catalog, account["image_urls"])
+    else:
+        catalog = ensure_image_catalog(account.get("image_urls_url"))
+    return choose_catalog_images(catalog, count)
+
+
+def load_accounts(path):
+    """
+    Reads account profiles from a JSON file: a list of objects (or {"accounts": [...]}) with
+    the keys in ACCOUNT_KEYS. String values written as "env:NAME" are read from the environment
+    variable NAME, so tokens can stay in a Kubernetes Secret. Missing topics default to TOPICS.
+    Raises ValueError for unknown keys or duplicate names.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    profiles = data["accounts"] if isinstance(data, dict) else data
+    accounts = []
+    for index, profile in enumerate(profiles):
+        unknown = set(profile) - set(ACCOUNT_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown keys in account {index + 1} of {path}: {', '.join(sorted(unknown))}")
+        account = {
+            key: os.getenv(value[4:], "") if isinstance(value, str) and value.startswith("env:") else value
+            for key, value in profile.items()
+        }
+        account.setdefault("name", f"account-{index + 1}")
+        account.setdefault("topics", TOPICS)
+        if "image_urls" not in account:
+            account.setdefault("image_urls_url", IMAGE_URLS_URL)
+        accounts.append(account)
+    names = [account["name"] for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Account names in {path} must be unique")
+    return accounts
+
+
+def with_platform_slot(platform, func, *args, **kwargs):
+    """
+    Calls func while holding one of the platform's concurrency slots.
+    """
+    with _platform_slots[platform]:
+        return func(*args, **kwargs)
+
+
+def run_accounts(accounts, workers=None, cycle_id=None):
+    """
+    Runs one post cycle per account in a bounded worker pool and prints a summary.
+    Text posts to Facebook pages are grouped into Graph batch requests (see GraphBatcher), and
+    cached Gemini texts are not handed to the same account twice.
+    Returns a dict mapping account name to its send_social_media_post() result.
+    """
+    global facebook_batcher, gemini_cache_per_account
+    workers = max(1, min(workers or ACCOUNT_WORKERS, len(accounts)))
+    results = {}
+    start = time.perf_counter()
+    if FACEBOOK_BATCH and len(accounts) > 1:
+        # Each worker runs one cycle at a time, so a batch is complete once every worker has queued a post
+        facebook_batcher = GraphBatcher(FACEBOOK_BATCH_LINGER_MS / 1000, size=workers)
+    gemini_cache_per_account = len(accounts) > 1
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="account") as executor:
+            futures = {
+                executor.submit(send_social_media_post, account, cycle_id): account["name"] for account in accounts
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"Post cycle for {name} failed: {e}")
+                    results[name] = {"account": name, "facebook": False, "twitter": False, "error": str(e)}
+    finally:
+        if facebook_batcher is not None:
+            facebook_batcher.flush()
+            facebook_batcher = None
+        gemini_cache_per_account = False
+    wall_time = time.perf_counter() - start
+
+    print(f"\n--- Accounts summary: {len(accounts)} accounts in {wall_time:.2f}s ---")
+    for account in accounts:
+        result = results[account["name"]]
+        status = " ".join(
+            f"{platform}={'ok' if result.get(platform) else 'FAILED'}" for platform in ("facebook", "twitter")
+        )
+        detail = f"error: {result['error']}" if "error" in result else f"{result.get('wall_seconds', 0):.2f}s"
+        print(f"  {account['name']}: {status} ({detail})")
+    for key, stats in rate_limiter.report().items():
+        if stats["waited_seconds"]:
+            print(f"  Rate-limit queue {key}: {stats['calls']} calls, waited {stats['waited_seconds']:.2f}s "
+                  f"(max {stats['max_wait_seconds']:.2f}s)")
+    return results
+
+
+def run_configured_cycle(accounts_file=None, workers=None, cycle_id=None):
+    """
+    Runs one cycle for every account in the accounts file (ACCOUNTS_FILE by default),
+    or for the environment-configured account when there is no accounts file.
+    """
+    accounts_file = accounts_file or ACCOUNTS_FILE
+    if accounts_file:
+        return run_accounts(load_accounts(accounts_file), workers, cycle_id)
+    return send_social_media_post(cycle_id=cycle_id)
+
+# --- Daemon Mode ---
+# `python main.py daemon` keeps one process running instead of starting a pod per post.
+# The Gemini model, HTTP sessions, image catalog and caches stay warm between cycles,
+# and send_social_media_post() runs at the times of POST_SCHEDULE (same cron expression
+# as cronjob.yaml). A cycle that is still running when the next one is due is skipped.
+# Cycles and catalog refreshes run on worker threads, so the scheduler loop never waits on them.
+# GET /healthz on HEALTH_PORT reports the scheduler state, with status 503 once the scheduler
+# loop has not ticked for SCHEDULER_STALL_SECONDS or a cycle has run longer than
+# CYCLE_DEADLINE_MINUTES; GET /metrics returns the cycle metrics.
+POST_SCHEDULE = os.getenv("POST_SCHEDULE", "0 5,6,7,10,12,13,14,16,18,21 * * *")
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8080"))
+CATALOG_REFRESH_HOURS = int(os.getenv("CATALOG_REFRESH_HOURS", "6"))
+SCHEDULER_STALL_SECONDS = int(os.getenv("SCHEDULER_STALL_SECONDS", "300"))  # the loop ticks at least every minute
+CYCLE_DEADLINE_MINUTES = int(os.getenv("CYCLE_DEADLINE_MINUTES", "30"))
+
+_cycle_lock = threading.Lock()
+_catalog_refresh_lock = threading.Lock()
+daemon_status = {
+    "started_at": None,
+    "last_tick_at": None,
+    "running": False,
+    "cycles": 0,
+    "skipped": 0,
+    "last_started_at": None,
+    "last_finished_at": None,
+    "last_result": None,
+    "next_run_at": None,
+}
+
+
+def parse_cron_times(expression):
+    """
+    Returns the sorted "HH:MM" times of day matched by a daily cron expression
+    ("minute hour * * *", with lists, ranges, * and steps). Raises ValueError for other expressions.
+    """
+    fields = expression.split()
+    if len(fields) != 5 or fields[2:] != ["*", "*", "*"]:
+        raise ValueError(f"Only daily cron expressions (minute hour * * *) are supported: {expression!r}")
+
+    def expand(field, upper):
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = 0, upper
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-", 1))
+            else:
+                start = end = int(part)
+                if step:
+                    end = upper
+            if not 0 <= start <= end <= upper:
+                raise ValueError(f"Cron field out of range: {field!r}")
+            values.update(range(start, end + 1, int(step or 1)))
+        return values
+
+    minutes = expand(fields[0], 59)
+    hours = expand(fields[1], 23)
+    return sorted(f"{hour:02d}:{minute:02d}" for hour in hours for minute in minutes)
+
+
+def run_scheduled_cycle():
+    """
+    Runs one post cycle unless the previous one is still in progress.
+    """
+    if not _cycle_lock.acquire(blocking=False):
+        print("Previous post cycle is still running. Skipping this run.")
+        daemon_status["skipped"] += 1
+        return
+    daemon_status["running"] = True
+    daemon_status["last_started_at"] = time.time()
+    try:
+        # Each scheduled slot is its own cycle in the outbox
+        daemon_status["last_result"] = run_configured_cycle(cycle_id=time.strftime("%Y-%m-%dT%H:%M"))
+        daemon_status["rate_limits"] = rate_limiter.report()
+    except Exception as e:
+        print(f"Post cycle failed: {e}")
+        daemon_status["last_result"] = {"error": str(e)}
+    finally:
+        daemon_status["cycles"] += 1
+        daemon_status["last_finished_at"] = time.time()
+        daemon_status["running"] = False
+        _cycle_lock.release()
+
+
+def run_scheduled_catalog_refresh():
+    """
+    Re-fetches the image catalogs unless the previous refresh is still in progress.
+    """
+    if not _catalog_refresh_lock.acquire(blocking=False):
+        print("Previous image catalog refresh is still running. Skipping this run.")
+        return
+    try:
+        refresh_image_urls()
+    except Exception as e:
+        print(f"Image catalog refresh failed: {e}")
+    finally:
+        _catalog_refresh_lock.release()
+
+
+def daemon_health_problems(now=None):
+    """
+    Returns why the daemon is unhealthy (a stalled scheduler loop or a cycle past its
+    deadline), or an empty list.
+    """
+    now = time.time() if now is None else now
+    problems = []
+    last_tick_at = daemon_status["last_tick_at"] or daemon_status["started_at"]
+    if last_tick_at is not None and now - last_tick_at > SCHEDULER_STALL_SECONDS:
+        problems.append(f"scheduler has not run for {now - last_tick_at:.0f}s")
+    if daemon_status["running"] and now - daemon_status["last_started_at"] > CYCLE_DEADLINE_MINUTES * 60:
+        problems.append(f"post cycle running for {(now - daemon_status['last_started_at']) / 60:.0f} minutes")
+    return problems
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status = 200
+        if self.path == "/metrics":
+            body, content_type = prometheus_metrics().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path in ("/health", "/healthz"):
+            problems = daemon_health_problems()
+            status = 503 if problems else 200
+            body = json.dumps(dict(daemon_status, problems=problems), default=str).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_daemon():
+    """
+    Runs the scheduler loop until SIGTERM/SIGINT, then waits for a running cycle to finish.
+    """
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"Received signal {signum}. Shutting down after the current cycle...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    cycle_threads = []
+
+    def start_cycle():
+        cycle_threads[:] = [thread for thread in cycle_threads if thread.is_alive()]
+        thread = threading.Thread(target=run_scheduled_cycle, name="post-cycle")
+        thread.start()
+        cycle_threads.append(thread)
+
+    def start_catalog_refresh():
+        # A daemon thread: shutdown does not wait for a catalog fetch
+        threading.Thread(target=run_scheduled_catalog_refresh, name="catalog-refresh", daemon=True).start()
+
+    import schedule
+
+    # Warm everything a cycle needs before the first scheduled post
+    get_model()
+    get_image_urls()
+
+    scheduler = schedule.Scheduler()
+    post_times = parse_cron_times(POST_SCHEDULE)
+    for post_time in post_times:
+        scheduler.every().day.at(post_time).do(start_cycle)
+    scheduler.every(CATALOG_REFRESH_HOURS).hours.do(start_catalog_refresh)
+
+    health_server = ThreadingHTTPServer(("0.0.0.0", HEALTH_PORT), HealthHandler)
+    threading.Thread(target=health_server.serve_forever, name="health", daemon=True).start()
+    daemon_status["started_at"] = time.time()
+    print(f"Daemon started. Posting at {', '.join(post_times)}. Health check on port {HEALTH_PORT}.")
+
+    while not stop_event.is_set():
+        daemon_status["last_tick_at"] = time.time()
+        scheduler.run_pending()
+        daemon_status["next_run_at"] = scheduler.next_run
+        idle_seconds = scheduler.idle_seconds
+        stop_event.wait(max(1, min(60, idle_seconds if idle_seconds is not None else 60)))
+
+    for thread in cycle_threads:
+        thread.join()
+    health_server.shutdown()
+    print("Daemon stopped.")
+
+# --- Startup Report ---
+# `python main.py startup-report` imports this module in a fresh interpreter with
+# `-X importtime` and summarises where the startup time goes, including whether any
+# of the heavy dependencies were imported. startup_report() returns the same data.
+HEAVY_MODULES = ("google.generativeai", "grpc", "bs4", "PIL", "requests_oauthlib", "schedule")
+
+
+def startup_report(code="import main"):
+    """
+    Runs `code` in a new interpreter with -X importtime from this file's directory.
+    Returns a dict with the wall time, the cumulative import time of every top-level
+    import (in microseconds, slowest first) and the heavy modules that got imported.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    wall_time = time.perf_counter() - start
+    imported = {}
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        module = name.strip()
+        imported[module] = int(cumulative)
+        # -X importtime indents nested imports; only top-level entries add up to the total
+        if not name[1:].startswith(" "):
+            top_level[module] = int(cumulative)
+    heavy = [module for module in HEAVY_MODULES if module in imported]
+    return {
+        "returncode": result.returncode,
+        "wall_seconds": wall_time,
+        "import_us": sum(top_level.values()),
+        "top_level": dict(sorted(top_level.items(), key=lambda item: item[1], reverse=True)),
+        "heavy_modules": heavy,
+    }
+
+
+def print_startup_report(code="import main", limit=15):
+    report = startup_report(code)
+    print(f"Startup for {code!r}: {report['wall_seconds']:.3f}s wall-clock, "
+          f"{report['import_us']/1000:.1f} ms in imports (exit code {report['returncode']})")
+    for module, cumulative in list(report["top_level"].items())[:limit]:
+        print(f"  {cumulative/1000:8.1f} ms  {module}")
+    print(f"Heavy modules imported: {', '.join(report['heavy_modules']) or 'none'}")
+    return report
+
+# --- Replay Load Test ---
+# `python main.py load-test` runs many full post cycles offline against a recorded cassette
+# (see Traffic Recording). --processes workers each run `main.py post --repeat N` with
+# TRAFFIC_MODE=replay in their own temporary directory, so they share nothing but the
+# read-only cassette. Replayed Gemini texts repeat, so the workers switch the near-duplicate
+# check off (DUPLICATE_WINDOW_DAYS=0).
+LOAD_TEST_DATA_FILES = {
+    "IMAGE_CATALOG_PATH": "image_catalog.db",
+    "IMAGE_CACHE_DIR": ".image_cache",
+    "TRENDS_CACHE_PATH": ".trends_cache.json",
+    "GEMINI_CACHE_PATH": "gemini_cache.db",
+    "CONTENT_BANK_PATH": "content_bank.db",
+    "OUTBOX_PATH": "outbox.db",
+    "DUPLICATE_INDEX_PATH": "published_posts.db",
+    "METRICS_LOG_PATH": "metrics.jsonl",
+    "METRICS_TEXTFILE_PATH": "metrics.prom",
+}
+
+
+def run_repeated_cycles(repeat, accounts_file=None, workers=None):
+    """
+    Runs repeat cycles (for every configured account), each under a new cycle ID, and
+    prints a one-line summary of how many posts succeeded.
+    """
+    start = time.perf_counter()
+    runs = 0
+    posted = {"facebook": 0, "twitter": 0}
+    for index in range(repeat):
+        results = run_configured_cycle(accounts_file, workers, cycle_id=f"repeat-{os.getpid()}-{index}")
+        for result in [results] if "facebook" in results else results.values():
+            runs += 1
+            for platform in posted:
+                posted[platform] += bool(result.get(platform))
+    wall_time = time.perf_counter() - start
+    print(f"Ran {runs} account cycles in {wall_time:.2f}s: "
+          f"facebook {posted['facebook']} ok, twitter {posted['twitter']} ok")
+    return posted
+
+
+def run_load_test(cycles, processes, accounts_file=None, workers=None, speed=None):
+    """
+    Replays cycles post cycles from the cassette across processes worker processes and
+    prints each worker's summary and the overall throughput. Returns the cycles per second.
+    """
+    if not os.path.exists(TRAFFIC_CASSETTE_PATH):
+        print(f"No cassette at {TRAFFIC_CASSETTE_PATH}. Record one first with TRAFFIC_MODE=record.")
+        return None
+    speed = TRAFFIC_REPLAY_SPEED if speed is None else speed
+    shares = [cycles // processes + (index < cycles % processes) for index in range(processes)]
+    with tempfile.TemporaryDirectory(prefix="load-test-") as work_dir:
+        started = []
+        start = time.perf_counter()
+        for index, repeat in enumerate(shares):
+            if not repeat:
+                continue
+            data_dir = os.path.join(work_dir, f"worker-{index}")
+            os.makedirs(data_dir)
+            env = dict(
+                os.environ, **LOAD_TEST_DATA_FILES, TRAFFIC_MODE="replay", TRAFFIC_REPLAY_SPEED=str(speed),
+                TRAFFIC_CASSETTE_PATH=os.path.abspath(TRAFFIC_CASSETTE_PATH), DUPLICATE_WINDOW_DAYS="0",
+                CYCLE_ID="", LOG_PAYLOADS="false",
+            )
+            command = [sys.executable, os.path.abspath(__file__), "post", "--repeat", str(repeat)]
+            if accounts_file:
+                command += ["--accounts", os.path.abspath(accounts_file)]
+            if workers:
+                command += ["--workers", str(workers)]
+            log_path = os.path.join(data_dir, "output.log")
+            with open(log_path, "w") as log:
+                process = subprocess.Popen(command, cwd=data_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+            started.append((index, process, log_path))
+        for index, process, log_path in started:
+            returncode = process.wait()
+            with open(log_path) as log:
+                lines = log.read().splitlines()
+            summary = lines[-1] if lines else "no output"
+            print(f"  worker {index}: {summary}" + (f" (exit code {returncode})" if returncode else ""))
+        wall_time = time.perf_counter() - start
+    print(f"Replayed {cycles} cycles with {len(started)} processes in {wall_time:.2f}s "
+          f"({cycles / wall_time:.1f} cycles/s, replay speed {speed:g})")
+    return cycles / wall_time
 
 # --- Main Execution Block ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and publish social media posts.")
+    subparsers = parser.add_subparsers(dest="command")
+    post_parser = subparsers.add_parser("post", help="Run one post cycle (default)")
+    post_parser.add_argument("--accounts", default=ACCOUNTS_FILE, help="JSON file with account profiles")
+    post_parser.add_argument("--workers", type=int, default=ACCOUNT_WORKERS, help="Accounts posted in parallel")
+    post_parser.add_argument("--repeat", type=int, default=1, help="Run this many cycles, each with a new cycle ID")
+    fill_parser = subparsers.add_parser("fill-bank", help="Pre-generate posts into the content bank")
+    fill_parser.add_argument("--per-topic", type=int, default=CONTENT_BANK_PER_TOPIC, help="Post pairs to keep per topic")
+    fill_parser.add_argument("--workers", type=int, default=CONTENT_BANK_WORKERS, help="Parallel Gemini requests")
+    subparsers.add_parser("daemon", help="Keep running and post on POST_SCHEDULE")
+    report_parser = subparsers.add_parser("startup-report", help="Show where import/startup time goes")
+    report_parser.add_argument("--code", default="import main", help="Python code to time in a fresh interpreter")
+    load_parser = subparsers.add_parser("load-test", help="Replay recorded traffic through many post cycles")
+    load_parser.add_argument("--cycles", type=int, default=100, help="Post cycles to run in total")
+    load_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    load_parser.add_argument("--accounts", default=ACCOUNTS_FILE, help="JSON file with account profiles")
+    load_parser.add_argument("--workers", type=int, default=ACCOUNT_WORKERS, help="Accounts posted in parallel")
+    load_parser.add_argument("--speed", type=float, default=TRAFFIC_REPLAY_SPEED,
+                             help="Replay speed: 1 keeps the recorded timing, 0 replays without delay")
+    args = parser.parse_args(argv)
+
+    if args.command == "fill-bank":
+        fill_content_bank(args.per_topic, args.workers)
+    elif args.command == "daemon":
+        run_daemon()
+    elif args.command == "startup-report":
+        print_startup_report(args.code)
+    elif args.command == "load-test":
+        run_load_test(args.cycles, args.processes, args.accounts, args.workers, args.speed)
+    elif getattr(args, "repeat", 1) > 1:
+        run_repeated_cycles(args.repeat, args.accounts, args.workers)
+    else:
+        run_configured_cycle(getattr(args, "accounts", None), getattr(args, "workers", None))
+
+
 if __name__ == "__main__":
-    send_social_media_post()
\ No newline at end of file
+    main()